@@ -1,62 +1,142 @@
 # -*- coding: utf-8 -*-
+"""
+The Flask app is created by create_app(). Importing the package only
+creates the extensions, which are bound to the app by their init_app().
+Nothing touches the database at startup, the schema is created and
+upgraded by ´flask init-db´ (see app/commands.py), and engines, worker
+threads and the template version are set up on first use.
+"""
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_heroku import Heroku
-from flask_debugtoolbar import DebugToolbarExtension
 import os
-from os import listdir
-from os.path import isfile, join
-import random
-import datetime
+from app.functions import random_string, is_christmas
 
-def files_in_dir(directory):
-    """
-    :param directory: The directory
-    :return: List of all files in directory
-    """
-    return [f for f in listdir(directory) if isfile(join(directory,f))]
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+# Pool sizes per backend, SQLite pragmas and a read-only session, see app/database.py
+from app import database
+db = SQLAlchemy()
+read_db = database.ReadOnlySession(db)
+
+# Request latency histograms and named spans, served on /metrics
+from app.instrumentation import Metrics
+metrics = Metrics()
+
+# Per-process cache of render results, shared by identical programs
+from app.streprogen import RenderCache
+render_cache = RenderCache(os.environ.get('RENDER_CACHE_SIZE', 512))
+
+# Per-process cache of rendered program pages, with ETags
+from app.httpcache import PageCache
+page_cache = PageCache()
+
+# Per-process cache of pre-serialized programs for /api/programs
+from app.api import DocumentCache
+api_cache = DocumentCache(os.environ.get('API_CACHE_SIZE', 256))
+
+# Fingerprinted, precompressed static files, see ´flask build-assets´
+from app.assets import Assets
+assets = Assets()
 
-def random_string(length):
+from . import models
+
+# Buffered date_lastviewed updates, so viewing a program is a pure read
+from app.writebehind import LastViewedBuffer
+last_viewed = LastViewedBuffer(db, models.Program.__table__)
+
+# Renders programs in worker threads, with bounded admission
+from app.jobs import RenderQueue
+render_queue = RenderQueue(db, models.RenderJob)
+
+# Process pool of /api/batch, with bounded admission
+from app.jobs import BatchPool
+batch_pool = BatchPool()
+
+metrics.add_gauge('streprogen_render_cache_hits', 'Render cache hits.', lambda: render_cache.hits)
+metrics.add_gauge('streprogen_render_cache_misses', 'Render cache misses.', lambda: render_cache.misses)
+metrics.add_gauge('streprogen_page_cache_pages', 'Pages in the page cache.', lambda: len(page_cache))
+metrics.add_gauge('streprogen_api_cache_programs', 'Programs in the API document cache.',
+                  lambda: len(api_cache))
+metrics.add_gauge('streprogen_render_queue_queued', 'Render jobs waiting for a worker.',
+                  lambda: render_queue.stats()['queued'])
+metrics.add_gauge('streprogen_render_queue_running', 'Render jobs running.',
+                  lambda: render_queue.stats()['running'])
+
+# Set by create_app(), exported as NaN until then
+startup_seconds = None
+metrics.add_gauge('streprogen_startup_seconds', 'Seconds to import the package and create the app.',
+                  lambda: startup_seconds)
+
+
+def create_app(config=None):
     """
-    :param length: Legnth of the returned string
-    :return: String og random characters
+    Create and configure the app. ´config´ is a dict of settings applied
+    last, e.g. {'TESTING': True}, which also leaves out the debug toolbar.
+
+    The time since the package was first imported is the startup time, it
+    is stored as app.startup_seconds and a warning is logged if it exceeds
+    STARTUP_BUDGET_SECONDS.
     """
-    chars = 'QAZWSXEDCRFVTGBYHNUJMKLP23456789'
-    return ''.join([random.choice(chars) for i in range(length)])
-
-def is_christmas():
-    now = datetime.datetime.now()
-    if now.month != 12:
-        return False
-    if now.day < 30 and now.day > 10:
-        return True
-    return False
-    
-    
-basedir = os.path.abspath(os.path.dirname(__file__))
+    started = time.perf_counter()
+    app = Flask(__name__)
 
+    #app.config['CSRF_ENABLED'] = True
+    app.config['SECRET_KEY'] = random_string(10)
+    # The modification signals are not used
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-app = Flask(__name__)
+    # If running on Heroku
+    if 'DYNO' in os.environ:
+        from flask_heroku import Heroku
+        Heroku(app)
+        app.debug = False
+    else:
+        app.debug = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'database.db')
+        app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+        #app.config['SERVER_NAME'] =
+    app.config.update(config or {})
 
-#app.config['CSRF_ENABLED'] = True
-app.config['SECRET_KEY'] = random_string(10)
+    if app.debug and not app.testing:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
 
-# If running on Heroku
-if 'DYNO' in os.environ:
-    heroku = Heroku(app)
-    app.debug = False
-else:
-    app.debug = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'database.db')
-    toolbar = DebugToolbarExtension(app)
-    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-    #app.config['SERVER_NAME'] = 
+    database.configure(app)
+    database.instrument()
+    db.init_app(app)
+    read_db.init_app(app)
 
-db = SQLAlchemy(app)
+    metrics.init_app(app, profile_rate=os.environ.get('PROFILE_SAMPLE_RATE', 0),
+                     profile_threshold=os.environ.get('PROFILE_SLOW_SECONDS', 1.0),
+                     profile_dir=os.environ.get('PROFILE_DIR', os.path.join(basedir, os.pardir, 'profiles')))
+    page_cache.init_app(app, maxsize=os.environ.get('PAGE_CACHE_SIZE', 128),
+                        max_age=os.environ.get('PAGE_CACHE_MAX_AGE', 3600))
+    last_viewed.init_app(app, interval=os.environ.get('LASTVIEWED_FLUSH_INTERVAL', 60),
+                         max_size=os.environ.get('LASTVIEWED_FLUSH_SIZE', 500))
+    render_queue.init_app(app, workers=os.environ.get('RENDER_WORKERS', 2),
+                          max_pending=os.environ.get('RENDER_QUEUE_SIZE', 20),
+                          timeout=os.environ.get('RENDER_JOB_TIMEOUT', 300),
+                          retention=os.environ.get('RENDER_JOB_RETENTION', 86400))
+    batch_pool.init_app(app, processes=os.environ.get('BATCH_PROCESSES', 2),
+                        max_batches=os.environ.get('BATCH_CONCURRENCY', 1))
 
-app.jinja_env.globals.update(enumerate=enumerate, is_christmas=is_christmas)
+    assets.init_app(app)
+    app.jinja_env.globals.update(enumerate=enumerate, is_christmas=is_christmas)
 
-from . import views, models
+    from app.views import blueprint
+    app.register_blueprint(blueprint)
+    from app import commands
+    commands.init_app(app)
 
-# Create database (error if already exists)
-db.create_all()
\ No newline at end of file
+    # The first app of a process also pays for importing the package
+    global _import_started, startup_seconds
+    app.startup_seconds = startup_seconds = time.perf_counter() - (_import_started or started)
+    _import_started = None
+    budget = float(os.environ.get('STARTUP_BUDGET_SECONDS', 1.5))
+    if app.startup_seconds > budget:
+        app.logger.warning('Startup took {:.3f} s, the budget is {:.3f} s.'.format(
+            app.startup_seconds, budget))
+    return app
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Analytics across all stored programs, such as the distribution of durations.
+
+The aggregate table holds one counter per metric and key, e.g. 8 programs
+with ´duration´ ´6´, or 120 programs with the ´exercise´ ´squat´. The
+counters of a new program are added by record() when it is inserted, so
+reading a metric is an index lookup of its largest counters, and takes the
+same time however many programs there are.
+
+´flask rebuild-analytics´ recounts everything in one streaming pass over
+the program and archived_program tables, decoding only the header of each
+program. Use it after adding a metric, or if inserts were missed. Programs
+inserted while it runs may be missed, as the recount replaces the counters.
+"""
+from collections import Counter
+import lzma
+import pickle
+from flask import current_app
+from sqlalchemy import select, type_coerce
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app import db
+from app.models import Program, ArchivedProgram, Aggregate
+from app.streprogen import serialization
+
+METRICS = {
+    'programs': 'Number of programs.',
+    'duration': 'Programs by duration in weeks.',
+    'days': 'Programs by number of days.',
+    'exercises': 'Programs by number of main exercises.',
+    'units': 'Programs by units.',
+    'reps_RM': 'Programs by repetition maximum model.',
+    'intensity_model': 'Programs by intensity model.',
+    'intensity': 'Programs by average intensity, in steps of 2.5.',
+    'intensity_list': 'Programs by intensity per week.',
+    'reps': 'Programs by average reps scale, in steps of 10.',
+    'reps_per_exercise': 'Programs by repetitions per exercise.',
+    'exercise': 'Main exercises by name, lowercased.',
+}
+
+# Counters read at a time, the number of keys is not bounded for every metric
+MAX_LIMIT = 100
+
+
+def _number(value):
+    return '{:g}'.format(float(value))
+
+
+def counters(program):
+    """
+    Return a Counter of (metric, key) of a streprogen.Program, rendered or not.
+    """
+    counts = Counter()
+    counts['programs', ''] += 1
+    counts['duration', str(program.duration)] += 1
+    counts['days', str(len(program.days))] += 1
+    exercises = list(program.iter_exercises())
+    counts['exercises', str(len(exercises))] += 1
+    counts['units', str(program.units)[:128]] += 1
+    # Not set on some old programs
+    reps_RM = getattr(program, 'reps_RM_model', None)
+    if reps_RM:
+        counts['reps_RM', str(reps_RM)[:128]] += 1
+    if getattr(program, 'intensity_model', None):
+        counts['intensity_model', str(program.intensity_model)[:128]] += 1
+    if program.intensity_list:
+        mean = sum(float(i) for i in program.intensity_list) / len(program.intensity_list)
+        counts['intensity', _number(2.5 * round(mean / 2.5))] += 1
+        counts['intensity_list', ','.join(_number(i) for i in program.intensity_list)[:128]] += 1
+    if program.reps_list:
+        mean = sum(float(r) for r in program.reps_list) / len(program.reps_list)
+        counts['reps', _number(10 * round(mean / 10))] += 1
+    counts['reps_per_exercise', _number(program.reps_per_exercise)] += 1
+    for exercise in exercises:
+        counts['exercise', exercise.name.strip().lower()[:128]] += 1
+    return counts
+
+
+def _add(connection, counts):
+    """
+    Add the counts to the counters, inserting the missing ones.
+    """
+    table = Aggregate.__table__
+    for (metric, key), count in counts.items():
+        match = (table.c.metric == metric) & (table.c.key == key)
+        updated = connection.execute(table.update().where(match).values(count=table.c.count + count))
+        if not updated.rowcount:
+            connection.execute(table.insert().values(metric=metric, key=key, count=count))
+
+
+def record(programs, attempts=3):
+    """
+    Add the counters of newly inserted streprogen.Programs. Failures are
+    logged and not raised, the program is stored already.
+    """
+    counts = Counter()
+    for program in programs:
+        counts.update(counters(program))
+    for attempt in range(attempts):
+        try:
+            with db.engine.begin() as connection:
+                _add(connection, counts)
+            return
+        except IntegrityError:
+            # A counter was inserted by a concurrent request, it is updated on the next attempt
+            continue
+        except SQLAlchemyError:
+            # E.g. a locked database, the recount of ´flask rebuild-analytics´ catches up
+            db.session.rollback()
+            current_app.logger.exception('Recording the analytics of %d programs failed.', len(programs))
+            return
+    current_app.logger.warning('Recording the analytics of %d programs failed.', len(programs))
+
+
+def _stored_programs(chunk_size):
+    """
+    Yield every stored and archived streprogen.Program, with the rendered
+    weeks not decoded, or None for programs that can not be decoded. The
+    rows are read in chunks by id.
+    """
+    programs, archived = Program.__table__, ArchivedProgram.__table__
+    tables = [(programs, [type_coerce(programs.c.data, db.LargeBinary),
+                          type_coerce(programs.c.pickle, db.LargeBinary)]),
+              (archived, [archived.c.format, archived.c.payload])]
+    for table, columns in tables:
+        last_id = 0
+        while True:
+            with db.engine.connect() as connection:
+                rows = connection.execute(select([table.c.id] + columns).where(table.c.id > last_id)
+                                          .order_by(table.c.id).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+            for id, first, second in rows:
+                if table is archived:
+                    format, stored = first, lzma.decompress(second)
+                else:
+                    format, stored = ('data', first) if first is not None else ('pickle', second)
+                try:
+                    if format == 'data':
+                        yield serialization.loads(stored, rendered=False)
+                    else:
+                        yield pickle.loads(stored)._upgrade()
+                except Exception:
+                    yield None
+            last_id = rows[-1][0]
+
+
+def rebuild(chunk_size=200, progress=None):
+    """
+    Recount every counter, see the module docstring. ´progress´ is called
+    with the number of programs read after every chunk. Returns the
+    number of programs counted and the number that could not be decoded.
+    """
+    counts = Counter()
+    counted, failed = 0, 0
+    for program in _stored_programs(chunk_size):
+        if program is None:
+            failed += 1
+        else:
+            counts.update(counters(program))
+            counted += 1
+        if progress is not None and (counted + failed) % chunk_size == 0:
+            progress(counted + failed)
+
+    table = Aggregate.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.delete())
+        if counts:
+            connection.execute(table.insert(), [{'metric': metric, 'key': key, 'count': count}
+                                                for (metric, key), count in counts.items()])
+    return counted, failed
+
+
+def aggregate(metric, limit=20, session=None):
+    """
+    Return the largest counters of a metric as a list of (key, count),
+    largest first, with at most ´limit´ items. They are read backwards
+    from the index on (metric, count). ´session´ is the session to read
+    from, e.g. the read-only one.
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    query = ((session or db.session).query(Aggregate.key, Aggregate.count)
+             .filter(Aggregate.metric == metric)
+             .order_by(Aggregate.count.desc()).limit(limit))
+    return [(key, count) for key, count in query]
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-serialized JSON documents for the read-only program API.
+
+/api/programs/<unique_id> returns parts of a program, chosen by the query:
+
+    fields      Comma separated parts, of ´header´, ´weeks´ and ´stats´
+                (default ´header,weeks´).
+    weeks       A week or an inclusive range, e.g. ´3´ or ´2-4´ (default all).
+    days        Comma separated days, e.g. ´1,3´ (default all).
+    exercises   Comma separated exercise ids, as listed in the header
+                (default all).
+
+E.g. ?fields=weeks&weeks=3&days=2 is the session of day 2 in week 3.
+
+Programs never change once created, so a ProgramDocument keeps the JSON
+of every part: the header and stats when created, and the exercises of
+a week when the week is first requested, decoded on its own from the
+stored program. A response only joins the JSON of the requested parts.
+Documents are kept in a per-process LRU cache.
+"""
+from collections import OrderedDict
+import json
+import threading
+from app.streprogen import serialization
+
+FIELDS = ('header', 'weeks', 'stats')
+DEFAULT_FIELDS = ('header', 'weeks')
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+class ProjectionError(ValueError):
+    """
+    Raised for an invalid projection in the query.
+    """
+    pass
+
+
+def _integers(value, name):
+    try:
+        return [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ProjectionError('{} must be comma separated integers.'.format(name))
+
+
+class Projection(object):
+    """
+    The parts of a program requested by a query, see the module docstring.
+    """
+    def __init__(self, args):
+        """
+        Parameters
+        ----------
+        args : The query arguments, request.args.
+        """
+        fields = args.get('fields')
+        self.fields = tuple(f.strip() for f in fields.split(',') if f.strip()) if fields else DEFAULT_FIELDS
+        unknown = [f for f in self.fields if f not in FIELDS]
+        if unknown:
+            raise ProjectionError('Unknown fields: {}. Use {}.'.format(', '.join(unknown), ', '.join(FIELDS)))
+
+        self.weeks = None
+        if args.get('weeks'):
+            first, _, last = args['weeks'].partition('-')
+            try:
+                self.weeks = (int(first), int(last or first))
+            except ValueError:
+                raise ProjectionError('weeks must be a week or a range, e.g. 3 or 2-4.')
+        self.days = _integers(args['days'], 'days') if args.get('days') else None
+        self.exercises = ([e.strip() for e in args['exercises'].split(',') if e.strip()]
+                          if args.get('exercises') else None)
+
+
+class ProgramDocument(object):
+    """
+    The JSON of the parts of one program.
+    """
+    def __init__(self, unique_id, data, statistics):
+        """
+        Parameters
+        ----------
+        unique_id : The unique_id of the program.
+        data : The program, encoded by serialization.dumps.
+        statistics : JSON of Program.statistics.
+        """
+        self.unique_id = unique_id
+        self.data = data
+        program = serialization.loads(data, rendered=False)
+        program._assign_ids()
+        self.duration = program.duration
+        self.ids = [[ex.id for ex in day.main_exercises] for day in program.days]
+        self.names = dict((ex.id, ex.name) for ex in program.iter_exercises())
+
+        header = {'name': program.name,
+                  'units': program.units,
+                  'round': program.round,
+                  'duration': program.duration,
+                  'intensity': program.intensity_list,
+                  'reps': program.reps_list,
+                  'days': [{'day': d,
+                            'main': [{'id': ex.id,
+                                      'name': ex.name,
+                                      'current_max': ex.current_max,
+                                      'desired_max': ex.desired_max,
+                                      'low_reps': ex.low_reps,
+                                      'high_reps': ex.high_reps} for ex in day.main_exercises],
+                            'extra': [{'name': ex.name, 'scheme': ex.scheme}
+                                      for ex in day.extra_exercises]}
+                           for d, day in enumerate(program.days, 1)]}
+        self.header = _dumps(header)
+        self.stats = statistics
+        self._weeks = {}
+        self._lock = threading.Lock()
+
+    def week(self, week):
+        """
+        Return a list with, per day, a list of (exercise id, JSON) of a week.
+        """
+        days = self._weeks.get(week)
+        if days is None:
+            schemes = iter(serialization.loads_week(self.data, week))
+            days = []
+            for ids in self.ids:
+                days.append([])
+                for exercise_id in ids:
+                    reps, intensity, weights = next(schemes)
+                    days[-1].append((exercise_id, _dumps({'id': exercise_id,
+                                                         'name': self.names[exercise_id],
+                                                         'reps': reps,
+                                                         'intensity': intensity,
+                                                         'weights': weights})))
+            with self._lock:
+                self._weeks[week] = days
+        return days
+
+    def render(self, projection):
+        """
+        Return the JSON document of the projection, raising ProjectionError
+        if it asks for weeks, days or exercises the program does not have.
+        """
+        first, last = projection.weeks or (1, self.duration)
+        if not 1 <= first <= last <= self.duration:
+            raise ProjectionError('weeks must be within 1-{}.'.format(self.duration))
+        days = projection.days or list(range(1, len(self.ids) + 1))
+        if not all(1 <= day <= len(self.ids) for day in days):
+            raise ProjectionError('days must be within 1-{}.'.format(len(self.ids)))
+        exercises = projection.exercises
+        if exercises is not None:
+            unknown = [e for e in exercises if e not in self.names]
+            if unknown:
+                raise ProjectionError('Unknown exercises: {}.'.format(', '.join(unknown)))
+            exercises = set(exercises)
+
+        parts = ['"unique_id":' + _dumps(self.unique_id)]
+        if 'header' in projection.fields:
+            parts.append('"header":' + self.header)
+        if 'weeks' in projection.fields:
+            weeks = []
+            for week in range(first, last + 1):
+                cells = self.week(week)
+                day_parts = []
+                for day in days:
+                    chosen = [fragment for exercise_id, fragment in cells[day-1]
+                              if exercises is None or exercise_id in exercises]
+                    day_parts.append('{{"day":{},"exercises":[{}]}}'.format(day, ','.join(chosen)))
+                weeks.append('{{"week":{},"days":[{}]}}'.format(week, ','.join(day_parts)))
+            parts.append('"weeks":[' + ','.join(weeks) + ']')
+        if 'stats' in projection.fields:
+            parts.append('"stats":' + (self.stats or 'null'))
+        return '{' + ','.join(parts) + '}'
+
+
+class DocumentCache(object):
+    """
+    Bounded, thread safe LRU cache of ProgramDocuments by unique_id.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = int(maxsize)
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def get(self, unique_id, load):
+        """
+        Return the document of a program, or None if load() returns None.
+        load() is called on a miss, and returns a ProgramDocument.
+        """
+        with self._lock:
+            document = self._documents.get(unique_id)
+            if document is not None:
+                self._documents.move_to_end(unique_id)
+                return document
+        document = load()
+        if document is not None:
+            with self._lock:
+                self._documents[unique_id] = document
+                while len(self._documents) > self.maxsize:
+                    self._documents.popitem(last=False)
+        return document
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Archival of programs that are no longer viewed.
+
+´flask archive --months 12´ moves programs not viewed for that many months
+from the program table to the archived_program table, in chunks, with the
+stored program compressed with LZMA. Afterwards the database is vacuumed
+and analyzed, so the program table and its indexes shrink.
+
+An archived program is moved back by restore() the next time it is
+opened, so archiving is invisible to users apart from the first view
+being a little slower.
+"""
+from datetime import datetime, timedelta
+import lzma
+from sqlalchemy import and_, or_, select, type_coerce, bindparam
+from sqlalchemy.exc import IntegrityError
+from app import db, last_viewed
+from app.models import Program, ArchivedProgram
+
+# Copied as they are between the tables
+SUMMARY = ('unique_id', 'date_creation', 'date_lastviewed', 'name', 'days',
+           'exercises', 'duration', 'statistics')
+
+
+def _stored(table):
+    """
+    The stored program columns of the program table, as raw bytes. The
+    pickles are not unpickled, some old ones can not be.
+    """
+    return [type_coerce(table.c.data, db.LargeBinary).label('data'),
+            type_coerce(table.c.pickle, db.LargeBinary).label('pickle')]
+
+
+def archive(months, chunk_size=200, now=None, progress=None):
+    """
+    Move programs not viewed for ´months´ months to the archive, committing
+    every ´chunk_size´ programs. Programs that were never viewed count as
+    viewed when they were created. Returns (programs, bytes before, bytes
+    after compression). ´progress´ is called with the totals after every chunk.
+    """
+    # Views still in the buffer count
+    last_viewed.flush()
+    cutoff = (now or datetime.utcnow()) - timedelta(days=30 * months)
+    programs, archive_table = Program.__table__, ArchivedProgram.__table__
+    stale = or_(programs.c.date_lastviewed < cutoff,
+                and_(programs.c.date_lastviewed.is_(None), programs.c.date_creation < cutoff))
+    query = (select([programs.c.id] + [programs.c[name] for name in SUMMARY] + _stored(programs))
+             .where(stale).order_by(programs.c.id).limit(chunk_size))
+
+    archived, raw_bytes, compressed_bytes = 0, 0, 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(query.where(programs.c.id > last_id)).fetchall()
+            if not rows:
+                break
+            archived_rows = []
+            for row in rows:
+                format = 'data' if row.data is not None else 'pickle'
+                stored = row.data if row.data is not None else row.pickle
+                payload = lzma.compress(stored or b'')
+                raw_bytes += len(stored or b'')
+                compressed_bytes += len(payload)
+                values = dict((name, getattr(row, name)) for name in SUMMARY)
+                values.update(date_archived=datetime.utcnow(), format=format, payload=payload)
+                archived_rows.append(values)
+
+            connection.execute(archive_table.insert(), archived_rows)
+            connection.execute(programs.delete().where(programs.c.id.in_([row.id for row in rows])))
+        archived += len(rows)
+        last_id = rows[-1].id
+        if progress is not None:
+            progress(archived, raw_bytes, compressed_bytes)
+    return archived, raw_bytes, compressed_bytes
+
+
+def restore(unique_id):
+    """
+    Move an archived program back to the program table. Returns False if
+    there is no archived program with the unique_id.
+    """
+    programs, archive_table = Program.__table__, ArchivedProgram.__table__
+    try:
+        with db.engine.begin() as connection:
+            row = connection.execute(select([archive_table])
+                                     .where(archive_table.c.unique_id == unique_id)).first()
+            if row is None:
+                return False
+            values = dict((name, getattr(row, name)) for name in SUMMARY)
+            values['date_lastviewed'] = datetime.utcnow()
+            stored = lzma.decompress(row.payload)
+            # Raw bytes, not pickled again by the PickleType
+            values[row.format] = bindparam('_stored', stored, type_=db.LargeBinary)
+            connection.execute(programs.insert().values(**values))
+            connection.execute(archive_table.delete().where(archive_table.c.id == row.id))
+    except IntegrityError:
+        # Restored by a concurrent request
+        pass
+    return True
+
+
+def vacuum():
+    """
+    Reclaim the space of deleted rows and update the statistics of the
+    query planner. Runs outside a transaction, as VACUUM requires.
+    """
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        if db.engine.dialect.name == 'sqlite':
+            connection.execute(db.text('VACUUM'))
+            connection.execute(db.text('ANALYZE'))
+            # The rebuilt database went through the write-ahead log
+            connection.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        else:
+            for table in (Program.__tablename__, ArchivedProgram.__tablename__):
+                connection.execute(db.text('VACUUM ANALYZE {}'.format(table)))
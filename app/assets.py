@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprinted, precompressed static assets.
+
+´flask build-assets´ copies the assets in app/static to app/static/dist,
+with a digest of the content in every filename, e.g.
+css/bootswatch.1f3b2c4d5e6a.css, along with gzip and brotli compressed
+copies, and writes a manifest from the original paths to the new ones.
+Paths in url() of stylesheets are rewritten to the fingerprinted fonts.
+
+A fingerprinted file never changes, so /assets/<filename> serves it with
+an immutable Cache-Control for a year, picking the smallest encoding the
+client accepts. Templates use asset_url('css/bootswatch.css'), which falls
+back to the plain static URL for assets missing from the manifest, e.g.
+before the first build.
+
+Brotli is optional, without the brotli package only gzip copies are made.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import threading
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Not served from /static, or not to the browser
+EXCLUDED_DIRS = ('dist', 'less', 'scss')
+EXCLUDED_NAMES = ('Thumbs.db', '.DS_Store')
+# Compressing these is worth it, images and woff fonts are compressed already
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.eot', '.ttf', '.otf', '.json', '.map', '.txt')
+# Keep a compressed copy only if it saves this fraction of the size
+MIN_SAVINGS = 0.05
+MAX_AGE = 365 * 24 * 3600
+
+URL = re.compile(r'''url\(\s*(['"]?)([^'")?#]+)([^'")]*)\1\s*\)''')
+
+
+def fingerprint(content):
+    return hashlib.sha1(content).hexdigest()[:12]
+
+
+def fingerprinted_name(path, content):
+    """
+    Return ´css/site.css´ as ´css/site.<digest>.css´.
+    """
+    root, extension = os.path.splitext(path)
+    return '{}.{}{}'.format(root, fingerprint(content), extension)
+
+
+def rewrite_urls(path, content, manifest):
+    """
+    Rewrite relative url() references of the stylesheet at ´path´ to their
+    fingerprinted names. External and unknown URLs are left as they are.
+    """
+    directory = os.path.dirname(path)
+
+    def replace(match):
+        quote, target, suffix = match.groups()
+        if ':' in target or target.startswith('/'):
+            return match.group(0)
+        resolved = os.path.normpath(os.path.join(directory, target)).replace(os.sep, '/')
+        if resolved not in manifest:
+            return match.group(0)
+        new = os.path.relpath(manifest[resolved], directory or '.').replace(os.sep, '/')
+        return 'url({0}{1}{2}{0})'.format(quote, new, suffix)
+
+    return URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def iter_assets(static_dir):
+    """
+    Yield the paths of the assets, relative to static_dir, with stylesheets
+    last so the fonts and images they refer to are fingerprinted first.
+    """
+    paths = []
+    for directory, dirs, files in os.walk(static_dir):
+        relative = os.path.relpath(directory, static_dir)
+        if relative == '.':
+            dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS]
+        for name in files:
+            if name in EXCLUDED_NAMES:
+                continue
+            paths.append(os.path.normpath(os.path.join(relative, name)).replace(os.sep, '/'))
+    return sorted(paths, key=lambda path: (path.endswith('.css'), path))
+
+
+def compress(path, content):
+    """
+    Write gzip and brotli copies of the file next to it, if they are smaller.
+    """
+    if not path.endswith(COMPRESSED_EXTENSIONS):
+        return
+    encoders = [('.gz', lambda data: gzip.compress(data, 9))]
+    if brotli is not None:
+        encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    for suffix, encode in encoders:
+        compressed = encode(content)
+        if len(compressed) <= len(content) * (1 - MIN_SAVINGS):
+            with open(path + suffix, 'wb') as file:
+                file.write(compressed)
+
+
+def build(static_dir, dist_dir):
+    """
+    Fingerprint and compress every asset into dist_dir, and write the
+    manifest. Returns the manifest.
+    """
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest = {}
+    for path in iter_assets(static_dir):
+        with open(os.path.join(static_dir, path), 'rb') as file:
+            content = file.read()
+        if path.endswith('.css'):
+            content = rewrite_urls(path, content, manifest)
+        manifest[path] = fingerprinted_name(path, content)
+
+        target = os.path.join(dist_dir, manifest[path])
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        with open(target, 'wb') as file:
+            file.write(content)
+        compress(target, content)
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+    """
+    Serves the built assets and resolves their URLs in templates.
+    """
+    def __init__(self):
+        self.static_dir = None
+        self.dist_dir = None
+        self.reload = False
+        self._manifest = None
+        self._modified = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.static_dir = app.static_folder
+        self.dist_dir = os.path.join(app.static_folder, 'dist')
+        # Pick up a new build without restarting the development server
+        self.reload = app.debug
+        self._manifest = None
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send)
+        app.jinja_env.globals.update(asset_url=self.url)
+
+    @property
+    def manifest(self):
+        """
+        The manifest of the last build, read on first use, or {} if there is none.
+        """
+        path = os.path.join(self.dist_dir, 'manifest.json')
+        with self._lock:
+            if self.reload or self._manifest is None:
+                try:
+                    modified = os.path.getmtime(path)
+                    if self._manifest is None or modified != self._modified:
+                        with open(path) as file:
+                            self._manifest = json.load(file)
+                        self._modified = modified
+                except (IOError, OSError):
+                    self._manifest = {}
+            return self._manifest
+
+    def build(self):
+        with self._lock:
+            self._manifest = None
+        return build(self.static_dir, self.dist_dir)
+
+    def url(self, filename):
+        """
+        Return the URL of a static asset, fingerprinted if it is built.
+        """
+        built = self.manifest.get(filename)
+        if built is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=built)
+
+    def send(self, filename):
+        """
+        Serve a built asset, precompressed if the client accepts it.
+        """
+        mimetype = None
+        encoding = None
+        for suffix, name in (('.br', 'br'), ('.gz', 'gzip')):
+            if request.accept_encodings[name] and \
+                    os.path.isfile(os.path.join(self.dist_dir, filename + suffix)):
+                encoding = name
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                filename += suffix
+                break
+
+        response = send_from_directory(self.dist_dir, filename, mimetype=mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(MAX_AGE)
+        return response
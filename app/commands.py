@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Commands of the ´flask´ command line, e.g.
+
+    FLASK_APP=wsgi.py flask init-db
+
+On Heroku, init-db runs in the release phase (see the Procfile), so web
+workers start without touching the schema, and build-assets runs when the
+slug is compiled (see bin/post_compile).
+"""
+import click
+from flask.cli import with_appcontext
+from app import analytics, archive, assets, migrate, models
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """
+    Create the tables, and add columns and indexes missing from existing tables.
+    """
+    models.create_schema()
+    click.echo('The database schema is up to date.')
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """
+    Fingerprint and precompress the static files, see app/assets.py.
+    """
+    manifest = assets.build()
+    click.echo('Built {} assets in {}.'.format(len(manifest), assets.dist_dir))
+
+
+@click.command('archive')
+@click.option('--months', default=12, show_default=True,
+              help='Archive programs not viewed for this many months.')
+@click.option('--chunk-size', default=200, show_default=True, help='Programs moved per transaction.')
+@click.option('--vacuum/--no-vacuum', default=True, show_default=True,
+              help='Run VACUUM and ANALYZE afterwards.')
+@with_appcontext
+def archive_command(months, chunk_size, vacuum):
+    """
+    Move programs that are no longer viewed to the compressed archive, see app/archive.py.
+    """
+    def progress(programs, raw_bytes, compressed_bytes):
+        click.echo('Archived {} programs, {} bytes compressed to {}.'.format(
+            programs, raw_bytes, compressed_bytes))
+
+    programs, raw_bytes, compressed_bytes = archive.archive(months, chunk_size, progress=progress)
+    if not programs:
+        click.echo('No programs to archive.')
+    if vacuum:
+        archive.vacuum()
+        click.echo('Vacuumed and analyzed the database.')
+
+
+@click.command('reencode')
+@click.option('--chunk-size', default=200, show_default=True, help='Rows per chunk and transaction.')
+@click.option('--processes', type=int, default=None,
+              help='Worker processes, by default one per core. With 1, no pool is used.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run.')
+@with_appcontext
+def reencode_command(chunk_size, processes, restart):
+    """
+    Rewrite every stored program in the current format, see app/migrate.py.
+    """
+    state = migrate.reencode(chunk_size, processes, restart, progress=click.echo)
+    click.echo('Done in {:.1f} s: {} rows, {} rewritten, {} could not be decoded.'.format(
+        state.elapsed, state.rows, state.written, state.failed))
+
+
+@click.command('rebuild-analytics')
+@click.option('--chunk-size', default=200, show_default=True, help='Programs read per query.')
+@with_appcontext
+def rebuild_analytics_command(chunk_size):
+    """
+    Recount the analytics of every stored program, see app/analytics.py.
+    """
+    counted, failed = analytics.rebuild(chunk_size, progress=lambda programs: click.echo(
+        'Read {} programs.'.format(programs)))
+    click.echo('Counted {} programs, {} could not be decoded.'.format(counted, failed))
+
+
+def init_app(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(archive_command)
+    app.cli.add_command(reencode_command)
+    app.cli.add_command(rebuild_analytics_command)
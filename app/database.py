@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Database configuration: connection pooling, SQLite pragmas and a
+read-only session for GET routes.
+
+Everything is configured with environment variables:
+
+    DATABASE_POOL_SIZE      Connections kept open per process (default 5).
+    DATABASE_MAX_OVERFLOW   Extra connections allowed under load (default 10).
+    DATABASE_POOL_RECYCLE   Reconnect after this many seconds (default 1800).
+    DATABASE_POOL_TIMEOUT   Seconds to wait for a free connection (default 30).
+    DATABASE_PRE_PING       Check connections before use, 1 or 0 (default 1).
+    DATABASE_READ_URL       Database for the read-only session, e.g. a
+                            replica. Defaults to the main database.
+    SQLITE_BUSY_TIMEOUT     Milliseconds to wait for the writer lock (default 5000).
+    SQLITE_SYNCHRONOUS      OFF, NORMAL or FULL (default NORMAL, safe with WAL).
+    SQLITE_CACHE_SIZE       Page cache per connection in KiB (default 8192).
+
+The pool settings only apply to server databases such as Postgres. A
+SQLite file is opened per checkout, in WAL mode, so readers do not block
+the writer and the writer does not block readers, and the busy timeout
+makes concurrent gunicorn workers wait for the writer lock instead of
+failing.
+"""
+import os
+import sqlite3
+import threading
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import Pool
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+def _setting(name, default):
+    return type(default)(os.environ.get(name, default))
+
+
+def is_sqlite(uri):
+    return uri is None or uri.startswith('sqlite')
+
+
+def configure(app):
+    """
+    Set the pool options of Flask-SQLAlchemy for the backend. Call before
+    db.init_app(app).
+    """
+    if is_sqlite(app.config.get('SQLALCHEMY_DATABASE_URI')):
+        return
+    app.config['SQLALCHEMY_POOL_SIZE'] = _setting('DATABASE_POOL_SIZE', 5)
+    app.config['SQLALCHEMY_MAX_OVERFLOW'] = _setting('DATABASE_MAX_OVERFLOW', 10)
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = _setting('DATABASE_POOL_RECYCLE', 1800)
+    app.config['SQLALCHEMY_POOL_TIMEOUT'] = _setting('DATABASE_POOL_TIMEOUT', 30)
+
+
+def sqlite_pragmas(dbapi_connection, read_only=False):
+    """
+    Tune a new SQLite connection.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA busy_timeout = {:d}'.format(_setting('SQLITE_BUSY_TIMEOUT', 5000)))
+    if not read_only:
+        # Persistent, but a read-only connection can not switch the journal mode
+        cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = {}'.format(
+        {'OFF': 'OFF', 'FULL': 'FULL'}.get(os.environ.get('SQLITE_SYNCHRONOUS', '').upper(), 'NORMAL')))
+    # A negative cache size is in KiB instead of pages
+    cursor.execute('PRAGMA cache_size = -{:d}'.format(_setting('SQLITE_CACHE_SIZE', 8192)))
+    cursor.close()
+
+
+def _ping(dbapi_connection, connection_record, connection_proxy):
+    """
+    Check a pooled connection before handing it out. A connection closed by
+    the server is replaced by a new one, instead of failing the request.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def _connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        sqlite_pragmas(dbapi_connection, read_only=isinstance(dbapi_connection, ReadOnlyConnection))
+
+
+def instrument():
+    """
+    Add the SQLite pragmas and the pre-ping to every connection pool. The
+    listeners are on the Pool class, so engines can be created lazily.
+    """
+    if not event.contains(Pool, 'connect', _connect):
+        event.listen(Pool, 'connect', _connect)
+    if _setting('DATABASE_PRE_PING', 1) and not event.contains(Pool, 'checkout', _ping):
+        event.listen(Pool, 'checkout', _ping)
+
+
+class ReadOnlyConnection(sqlite3.Connection):
+    """
+    A SQLite connection opened read-only, which can not switch the journal mode.
+    """
+    pass
+
+
+class ReadOnlySession(object):
+    """
+    Session for routes that only read, e.g. GET routes.
+
+    It has its own engine, which connects to DATABASE_READ_URL if set. A
+    SQLite file is opened read-only (no writer lock is ever taken), other
+    databases start read-only transactions. The session does not autoflush
+    and is removed at the end of every app context. The engine is created
+    on the first query.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.uri = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self.session = scoped_session(sessionmaker(autoflush=False))
+
+    def init_app(self, app):
+        self.uri = os.environ.get('DATABASE_READ_URL') or app.config.get('SQLALCHEMY_DATABASE_URI')
+        self._engine = None
+        app.teardown_appcontext(self._remove)
+
+    @property
+    def engine(self):
+        with self._lock:
+            if self._engine is None:
+                self._engine = self._create_engine(self.uri)
+                self.session.configure(bind=self._engine)
+            return self._engine
+
+    def query(self, *entities):
+        """
+        Return a query in the read-only session, e.g. query(models.Program).
+        """
+        # Binds the session on first use
+        self.engine
+        return self.session.query(*entities)
+
+    def execute(self, statement, parameters=None):
+        """
+        Execute a statement in the read-only session.
+        """
+        self.engine
+        return self.session.execute(statement, parameters)
+
+    def _create_engine(self, uri):
+        if uri is None or uri.startswith('sqlite') and ':///' not in uri:
+            # An in-memory database is only visible to its own engine
+            return self.db.engine
+
+        if is_sqlite(uri):
+            path = uri.split(':///', 1)[1]
+            timeout = _setting('SQLITE_BUSY_TIMEOUT', 5000) / 1000
+
+            def connect():
+                return sqlite3.connect('file:{}?mode=ro'.format(path), uri=True, timeout=timeout,
+                                       check_same_thread=False, factory=ReadOnlyConnection)
+
+            return create_engine('sqlite://', creator=connect)
+
+        engine = create_engine(uri,
+                               pool_size=_setting('DATABASE_POOL_SIZE', 5),
+                               max_overflow=_setting('DATABASE_MAX_OVERFLOW', 10),
+                               pool_recycle=_setting('DATABASE_POOL_RECYCLE', 1800),
+                               pool_timeout=_setting('DATABASE_POOL_TIMEOUT', 30))
+        event.listen(engine, 'begin', self._read_only_transaction)
+        return engine
+
+    def _read_only_transaction(self, connection):
+        if hasattr(connection, 'exec_driver_sql'):
+            connection.exec_driver_sql('SET TRANSACTION READ ONLY')
+        else:
+            connection.execute('SET TRANSACTION READ ONLY')
+
+    def _remove(self, exception=None):
+        self.session.remove()
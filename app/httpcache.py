@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP-level caching of program pages.
+
+Once rendered, a program never changes, so the page for /overview and
+/print only depends on the program, the templates, the fingerprinted
+asset URLs in them and whether it is christmas. Rendered pages are kept
+in an LRU cache keyed on those, and responses carry a strong ETag and
+Last-Modified so that clients and shared caches can revalidate with a
+cheap 304.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import os
+import threading
+from flask import Response, request, session
+from app.functions import files_in_dir, is_christmas
+
+
+def template_version(directory, manifest_path=None):
+    """
+    Return a digest of the templates and the asset manifest, and the time
+    the newest of them was modified. A missing manifest is skipped.
+    """
+    digest = hashlib.sha1()
+    newest = 0
+    paths = [(name, os.path.join(directory, name)) for name in sorted(files_in_dir(directory))]
+    if manifest_path is not None and os.path.isfile(manifest_path):
+        # A new build of the assets changes the URLs in the pages, and removes the old files
+        paths.append(('manifest.json', manifest_path))
+    for name, path in paths:
+        with open(path, 'rb') as file:
+            digest.update(name.encode('utf-8') + file.read())
+        newest = max(newest, os.path.getmtime(path))
+    return digest.hexdigest()[:12], datetime.utcfromtimestamp(int(newest))
+
+
+class PageCache(object):
+    """
+    Bounded LRU cache of rendered pages, with conditional responses.
+    """
+    def __init__(self, template_dir=None, maxsize=128, max_age=3600, manifest_path=None):
+        """
+        Parameters
+        ----------
+        template_dir : Directory of the templates, used for the template version.
+        manifest_path : The manifest.json of the built assets, see app/assets.py.
+        maxsize : Maximum number of rendered pages to keep.
+        max_age : Seconds clients and shared caches may reuse a page without revalidating.
+        """
+        self.template_dir = template_dir
+        self.manifest_path = manifest_path
+        self.maxsize = int(maxsize)
+        self.max_age = int(max_age)
+        self._version = None
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, maxsize=128, max_age=3600):
+        self.template_dir = os.path.join(app.root_path, app.template_folder)
+        self.manifest_path = os.path.join(app.static_folder, 'dist', 'manifest.json')
+        self.maxsize = int(maxsize)
+        self.max_age = int(max_age)
+        self._version = None
+
+    @property
+    def version(self):
+        """
+        The tuple (digest, modified) of the templates and the asset
+        manifest, computed on first use.
+        """
+        if self._version is None:
+            self._version = template_version(self.template_dir, self.manifest_path)
+        return self._version
+
+    def __len__(self):
+        return len(self._pages)
+
+    def respond(self, page, unique_id, date_creation, render):
+        """
+        Return a response for a program page.
+
+        Parameters
+        ----------
+        page : Name of the page, e.g. ´overview´.
+        unique_id : The unique_id of the program.
+        date_creation : When the program was created.
+        render : Function returning the rendered page, called on a cache miss.
+        """
+        # Flashed messages are rendered into the page, so it can not be shared
+        if session.get('_flashes'):
+            return Response(render(), mimetype='text/html')
+
+        version, templates_modified = self.version
+        key = '{}:{}:{}:{}'.format(page, unique_id, version, int(is_christmas()))
+        response = Response(mimetype='text/html')
+        response.set_etag(hashlib.sha1(key.encode('utf-8')).hexdigest())
+        response.last_modified = max(date_creation, templates_modified)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+        with self._lock:
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+        if body is None:
+            body = render()
+            with self._lock:
+                self._pages[key] = body
+                while len(self._pages) > self.maxsize:
+                    self._pages.popitem(last=False)
+
+        response.set_data(body)
+        return response
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Always-on request instrumentation, exported in the Prometheus text format.
+
+Every request is timed into a latency histogram per route. Within a
+request, named spans time the phases we care about: ´db´ (every SQL
+statement), ´decode´ (loading a stored program), ´render´ (Program.render())
+and ´template´ (Jinja). The spans of a request are summed and sent in a
+Server-Timing header, so the breakdown of a slow page is visible in the
+browser, and each span is also kept in a histogram for /metrics.
+
+Optionally, a random sample of requests is run under cProfile, and the
+profile is written to disk if the request was slow.
+
+The metrics are per process, like the caches.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from flask import g, has_request_context, request
+import jinja2
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Histogram(object):
+    """
+    Thread safe histogram with labels, in the Prometheus sense.
+    """
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0]*len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def lines(self):
+        yield '# HELP {} {}'.format(self.name, self.description)
+        yield '# TYPE {} histogram'.format(self.name)
+        with self._lock:
+            series = [(key, list(counts), total, count)
+                      for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in series:
+            labels = ','.join('{}="{}"'.format(k, _escape(v)) for k, v in key)
+            prefix = labels + ',' if labels else ''
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield '{}_bucket{{{}le="{}"}} {}'.format(self.name, prefix, bound, bucket_count)
+            yield '{}_bucket{{{}le="+Inf"}} {}'.format(self.name, prefix, count)
+            yield '{}_sum{{{}}} {}'.format(self.name, labels, total)
+            yield '{}_count{{{}}} {}'.format(self.name, labels, count)
+
+
+class Metrics(object):
+    """
+    Request and span timings of the app, see the module docstring.
+    """
+    def __init__(self):
+        self.app = None
+        self.profile_rate = 0.0
+        self.profile_threshold = 1.0
+        self.profile_dir = 'profiles'
+        self.requests = Histogram('streprogen_request_duration_seconds',
+                                  'Time spent handling requests, per route.')
+        self.spans = Histogram('streprogen_span_duration_seconds',
+                               'Time spent in named phases (db, decode, render, template).')
+        self.profiles_written = 0
+        self._gauges = []
+
+    def init_app(self, app, profile_rate=0.0, profile_threshold=1.0, profile_dir='profiles'):
+        """
+        Parameters
+        ----------
+        app : The Flask app to instrument.
+        profile_rate : Fraction of requests run under cProfile, 0 disables profiling.
+        profile_threshold : Profiles of requests slower than this many seconds are written.
+        profile_dir : Directory the profiles are written to.
+        """
+        self.app = app
+        self.profile_rate = float(profile_rate)
+        self.profile_threshold = float(profile_threshold)
+        self.profile_dir = profile_dir
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.jinja_env.template_class = self._template_class()
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the body of the with statement as the span ´name´.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def add_span(self, name, seconds):
+        self.spans.observe(seconds, span=name)
+        if has_request_context():
+            spans = getattr(g, '_metrics_spans', None)
+            if spans is None:
+                spans = g._metrics_spans = OrderedDict()
+            spans[name] = spans.get(name, 0.0) + seconds
+
+    def add_gauge(self, name, description, function):
+        """
+        Export the value returned by function() as a gauge, NaN while it
+        returns None, e.g. before it is measured.
+        """
+        self._gauges.append((name, description, function))
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format.
+        """
+        lines = list(self.requests.lines())
+        lines.extend(self.spans.lines())
+        gauges = [('streprogen_profiles_written', 'Number of slow request profiles written.',
+                   lambda: self.profiles_written)] + self._gauges
+        for name, description, function in gauges:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} gauge'.format(name))
+            value = function()
+            lines.append('{} {}'.format(name, 'NaN' if value is None else value))
+        return '\n'.join(lines) + '\n'
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        if self.profile_rate and random.random() < self.profile_rate:
+            g._metrics_profile = cProfile.Profile()
+            g._metrics_profile.enable()
+
+    def _after_request(self, response):
+        start = getattr(g, '_metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.requests.observe(elapsed, route=route, method=request.method,
+                              status=response.status_code)
+
+        profile = getattr(g, '_metrics_profile', None)
+        if profile is not None:
+            profile.disable()
+            if elapsed >= self.profile_threshold:
+                self._write_profile(profile, route)
+
+        spans = getattr(g, '_metrics_spans', {})
+        timings = ['{};dur={:.2f}'.format(name, seconds * 1000) for name, seconds in spans.items()]
+        timings.append('total;dur={:.2f}'.format(elapsed * 1000))
+        response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def _write_profile(self, profile, route):
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'index'
+            filename = '{}-{}-{}.prof'.format(slug, int(time.time() * 1000), os.getpid())
+            profile.dump_stats(os.path.join(self.profile_dir, filename))
+            self.profiles_written += 1
+        except OSError:
+            self.app.logger.exception('Writing the profile of a slow request failed.')
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_metrics_query_start')
+        if starts:
+            self.add_span('db', time.perf_counter() - starts.pop())
+
+    def _template_class(self):
+        metrics = self
+
+        class Template(jinja2.Template):
+            def render(self, *args, **kwargs):
+                with metrics.span('template'):
+                    return super(Template, self).render(*args, **kwargs)
+
+        return Template
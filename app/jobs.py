@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous render jobs with bounded admission control.
+
+Rendering a program runs in a small pool of worker threads instead of in
+the request. At most ´max_pending´ jobs may be queued or running per
+process, further submissions are rejected with QueueFull so the view can
+shed load with a 503. The status of a job is stored in the render_job
+table, so any worker process can answer a status poll.
+
+Jobs live in the memory of the process, so jobs that were queued or running
+when a process exited, e.g. on a deploy, never finish. Jobs pending for
+longer than ´timeout´ are marked failed, and finished jobs are deleted after
+´retention´, both by expire(), which runs at most once a minute when jobs
+are submitted. A worker never moves a job out of failed, so an expired job
+stays failed even if its render finishes later.
+
+The worker threads run inside the gunicorn sync worker, and rendering is
+CPU bound Python that holds the GIL. The threads bound the number of
+pending renders and free the request, but a running render still slows
+the requests served by the same process. /api/batch renders in the
+process pool of BatchPool instead.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+import os
+import queue
+import threading
+import time
+import uuid
+
+PENDING = ('queued', 'running')
+# Seconds between runs of expire() in a process
+EXPIRE_INTERVAL = 60
+
+
+class QueueFull(Exception):
+    """
+    Raised when the render queue is saturated.
+    """
+    pass
+
+
+class RenderQueue(object):
+    """
+    Bounded queue of render jobs, processed by worker threads.
+    """
+    def __init__(self, db, job_model):
+        """
+        Parameters
+        ----------
+        db : The SQLAlchemy extension.
+        job_model : The model storing the status of jobs, models.RenderJob.
+        """
+        self.app = None
+        self.db = db
+        self.job_model = job_model
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._waits = deque(maxlen=100)
+        self._expired = 0
+        self._configure()
+
+    def init_app(self, app, workers=2, max_pending=20, timeout=300, retention=86400):
+        """
+        Parameters
+        ----------
+        app : The Flask app, jobs run in an app context.
+        workers : Number of worker threads, started when the first job is submitted.
+        max_pending : Maximum number of jobs queued or running at once.
+        timeout : Seconds after which a job that is still queued or running is failed.
+        retention : Seconds finished jobs are kept.
+        """
+        self.app = app
+        self._configure(workers, max_pending, timeout, retention)
+
+    def _configure(self, workers=2, max_pending=20, timeout=300, retention=86400):
+        self.workers = int(workers)
+        self.max_pending = int(max_pending)
+        self.timeout = int(timeout)
+        self.retention = int(retention)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def timed_out(self, job):
+        """
+        Whether a job is still queued or running after the timeout, e.g.
+        because the process running it exited.
+        """
+        return (job.status in PENDING and
+                job.date_submitted < datetime.utcnow() - timedelta(seconds=self.timeout))
+
+    def expire(self):
+        """
+        Fail the jobs pending for longer than the timeout, and delete the
+        jobs finished longer than the retention ago. Returns the number of
+        failed and deleted jobs.
+        """
+        now = datetime.utcnow()
+        model = self.job_model
+        failed = (model.query.filter(model.status.in_(PENDING),
+                                     model.date_submitted < now - timedelta(seconds=self.timeout))
+                  .update({'status': 'failed', 'error': 'The job timed out.', 'date_finished': now},
+                          synchronize_session=False))
+        deleted = (model.query.filter(~model.status.in_(PENDING),
+                                      model.date_finished < now - timedelta(seconds=self.retention))
+                   .delete(synchronize_session=False))
+        self.db.session.commit()
+        return failed, deleted
+
+    def _expire_periodically(self):
+        with self._lock:
+            if time.time() - self._expired < EXPIRE_INTERVAL:
+                return
+            self._expired = time.time()
+        try:
+            self.expire()
+        except Exception:
+            self.db.session.rollback()
+            self.app.logger.exception('Expiring render jobs failed.')
+
+    def submit(self, function, *args):
+        """
+        Queue function(*args), which must return the unique_id of the
+        stored program. Returns the id of the job, or raises QueueFull.
+        """
+        if not self._slots.acquire(False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull('{} render jobs are already pending.'.format(self.max_pending))
+
+        try:
+            job = self.job_model(id=uuid.uuid4().hex, status='queued',
+                                 date_submitted=datetime.utcnow())
+            self.db.session.add(job)
+            self.db.session.commit()
+            self._expire_periodically()
+            self._start_workers()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._queue.put((job.id, time.time(), function, args))
+        return job.id
+
+    def stats(self):
+        """
+        Return the queue depth, the number of running jobs and wait times in seconds.
+        """
+        with self._lock:
+            waits = list(self._waits)
+            return {'queued': self._queue.qsize(),
+                    'running': self._running,
+                    'max_pending': self.max_pending,
+                    'completed': self._completed,
+                    'rejected': self._rejected,
+                    'average_wait': sum(waits) / len(waits) if waits else 0.0,
+                    'max_wait': max(waits) if waits else 0.0}
+
+    def _start_workers(self):
+        """
+        Start the worker threads, in the process that first submits a
+        job (threads do not survive a fork).
+        """
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self._work, name='render-worker')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job_id, submitted, function, args = self._queue.get()
+            with self._lock:
+                self._running += 1
+                self._waits.append(time.time() - submitted)
+            try:
+                self._run(job_id, function, args)
+            except Exception:
+                self.app.logger.exception('Updating render job {} failed.'.format(job_id))
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                self._slots.release()
+
+    def _run(self, job_id, function, args):
+        with self.app.app_context():
+            if not self._update(job_id, status='running', date_started=datetime.utcnow()):
+                # Expired while queued, the job was marked failed already
+                return
+            try:
+                unique_id = function(*args)
+            except Exception as error:
+                self.db.session.rollback()
+                self.app.logger.exception('Render job {} failed.'.format(job_id))
+                self._update(job_id, status='failed', error=str(error)[:255],
+                             date_finished=datetime.utcnow())
+            else:
+                self._update(job_id, status='done', unique_id=unique_id,
+                             date_finished=datetime.utcnow())
+
+    def _update(self, job_id, **values):
+        """
+        Update a job that is still pending, not one failed by expire().
+        Returns whether it was updated.
+        """
+        model = self.job_model
+        updated = (model.query.filter(model.id == job_id, model.status.in_(PENDING))
+                   .update(values, synchronize_session=False))
+        self.db.session.commit()
+        return bool(updated)
+
+
+class BatchPool(object):
+    """
+    A long-lived, bounded process pool for /api/batch, shared by the
+    requests of a process. At most ´max_batches´ batches render at once,
+    further batches are rejected with QueueFull.
+    """
+    def __init__(self):
+        self.processes = 2
+        self.max_batches = 1
+        self._slots = threading.BoundedSemaphore(self.max_batches)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, processes=2, max_batches=1):
+        """
+        Parameters
+        ----------
+        app : The Flask app.
+        processes : Number of worker processes, at most one per core.
+        max_batches : Maximum number of batches rendering at once.
+        """
+        self.processes = max(1, min(int(processes), os.cpu_count() or 1))
+        self.max_batches = int(max_batches)
+        self._slots = threading.BoundedSemaphore(self.max_batches)
+
+    @property
+    def executor(self):
+        """
+        The pool, created in the process that first renders a batch, as a
+        pool does not survive a fork of the preloaded app.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            return self._executor
+
+    def run(self, function, *args):
+        """
+        Return function(*args, executor=pool), or raise QueueFull if
+        ´max_batches´ batches are rendering already.
+        """
+        if not self._slots.acquire(False):
+            raise QueueFull('{} batches are already rendering.'.format(self.max_batches))
+        try:
+            return function(*args, executor=self.executor)
+        except BrokenProcessPool:
+            # A worker died, e.g. out of memory, the next batch gets a new pool
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            self._slots.release()
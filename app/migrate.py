@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable re-encoding of every stored program.
+
+´flask reencode´ rewrites every row of the program table in the current
+storage format (see streprogen/serialization.py), converting old pickles,
+and refills the summary and statistics columns. Run it after changing
+the engine classes or the format.
+
+Rows are read in chunks ordered by id, decoded and encoded in a process
+pool, and written back with one transaction per chunk. The next chunk is
+encoded while the previous one is written. The id of the last written
+row is stored in the checkpoint table in the same transaction, so an
+interrupted run resumes where it stopped. Only one chunk per process is
+in memory at a time.
+"""
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pickle
+import time
+from sqlalchemy import bindparam, func, select, type_coerce
+from app import db
+from app.models import Program, Checkpoint, summary
+from app.streprogen import serialization
+
+CHECKPOINT = 'reencode'
+
+
+def reencode_row(row):
+    """
+    Decode and encode one row, given as (id, data, pickle) with the raw
+    bytes of the columns.
+
+    Returns
+    -------
+    Tuple (id, values, error), where values are the new columns of the
+    row, or None if the row is unchanged or could not be decoded, and
+    error is None unless the row could not be decoded.
+    """
+    id, data, pickled = row
+    try:
+        if data is not None:
+            program = serialization.loads(data)
+        else:
+            program = pickle.loads(pickled)._upgrade()
+        values = summary(program)
+        values['data'] = serialization.dumps(program)
+    except Exception as error:
+        return id, None, '{}: {}'.format(type(error).__name__, error)
+    if pickled is None and values['data'] == data:
+        return id, None, None
+    return id, values, None
+
+
+class Progress(object):
+    """
+    Totals of a run, passed to the progress callback after every chunk.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.rows = 0
+        self.written = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.last_id = 0
+        self.started = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / max(self.elapsed, 1e-9)
+
+    @property
+    def eta(self):
+        """
+        Estimated seconds left.
+        """
+        return (self.total - self.rows) / max(self.rows_per_second, 1e-9)
+
+    def __str__(self):
+        return ('{}/{} rows ({:.0f}%), {} rewritten, {} failed, {:.0f} rows/s, '
+                '{:.2f} MB/s read, {:.0f} s left, last id {}').format(
+            self.rows, self.total, 100 * self.rows / max(self.total, 1), self.written, self.failed,
+            self.rows_per_second, self.bytes_read / 1e6 / max(self.elapsed, 1e-9), self.eta,
+            self.last_id)
+
+
+def _read_chunk(connection, last_id, chunk_size):
+    table = Program.__table__
+    query = (select([table.c.id,
+                     type_coerce(table.c.data, db.LargeBinary),
+                     type_coerce(table.c.pickle, db.LargeBinary)])
+             .where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size))
+    return [tuple(row) for row in connection.execute(query)]
+
+
+def _write_chunk(results, last_id, progress):
+    """
+    Write the changed rows of a chunk and the checkpoint in one transaction.
+    """
+    table, checkpoints = Program.__table__, Checkpoint.__table__
+    updates = []
+    for id, values, error in results:
+        if error is not None:
+            progress.failed += 1
+        elif values is not None:
+            updates.append(dict(values, pickle=None, _id=id))
+
+    with db.engine.begin() as connection:
+        if updates:
+            connection.execute(table.update().where(table.c.id == bindparam('_id')), updates)
+        progress.written += len(updates)
+        progress.bytes_written += sum(len(values['data']) for values in updates)
+
+        updated = connection.execute(checkpoints.update().where(checkpoints.c.name == CHECKPOINT)
+                                     .values(last_id=last_id, date_updated=datetime.utcnow()))
+        if not updated.rowcount:
+            connection.execute(checkpoints.insert().values(name=CHECKPOINT, last_id=last_id,
+                                                           date_updated=datetime.utcnow()))
+
+
+def reencode(chunk_size=200, processes=None, restart=False, progress=None):
+    """
+    Re-encode every program, see the module docstring.
+
+    Parameters
+    ----------
+    chunk_size : Rows read, encoded and written at a time.
+    processes : Number of worker processes, by default one per core.
+                With 1, the rows are encoded in this process.
+    restart : Start from the first row instead of the checkpoint.
+    progress : Called with a Progress after every chunk.
+
+    Returns
+    -------
+    The Progress of the run.
+    """
+    checkpoints = Checkpoint.__table__
+    with db.engine.begin() as connection:
+        if restart:
+            connection.execute(checkpoints.delete().where(checkpoints.c.name == CHECKPOINT))
+        last_id = connection.execute(select([checkpoints.c.last_id])
+                                     .where(checkpoints.c.name == CHECKPOINT)).scalar() or 0
+        total = connection.execute(select([func.count()]).select_from(Program.__table__)
+                                   .where(Program.__table__.c.id > last_id)).scalar()
+
+    state = Progress(total)
+    state.last_id = last_id
+    workers = processes or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        pending = None
+        while True:
+            with db.engine.connect() as connection:
+                rows = _read_chunk(connection, last_id, chunk_size)
+            if rows:
+                last_id = rows[-1][0]
+                read = sum(len(row[1] or row[2] or b'') for row in rows)
+                if executor is None:
+                    results = [reencode_row(row) for row in rows]
+                else:
+                    # Submitted now, encoded while the previous chunk is written
+                    results = executor.map(reencode_row, rows,
+                                           chunksize=max(1, len(rows) // (4 * workers)))
+
+            if pending is not None:
+                pending_results, pending_last_id, pending_rows, pending_read = pending
+                _write_chunk(list(pending_results), pending_last_id, state)
+                state.rows += pending_rows
+                state.bytes_read += pending_read
+                state.last_id = pending_last_id
+                if progress is not None:
+                    progress(state)
+
+            if not rows:
+                break
+            pending = (results, last_id, len(rows), read)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Done, the next run starts from the first row again
+    with db.engine.begin() as connection:
+        connection.execute(checkpoints.delete().where(checkpoints.c.name == CHECKPOINT))
+    return state
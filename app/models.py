@@ -1,9 +1,271 @@
 # -*- coding: utf-8 -*-
-from app import db
+from app import db, metrics
+import json
+import re
+from app.functions import random_string
+from app.streprogen import serialization
+from sqlalchemy import inspect, text, or_, and_
+from sqlalchemy.exc import IntegrityError
+from flask import current_app
 
 class Program(db.Model):
     id = db.Column(db.Integer(), primary_key = True)
-    unique_id = db.Column(db.String(32))
+    unique_id = db.Column(db.String(32), unique=True, index=True)
+    date_creation = db.Column(db.DateTime())
+    date_lastviewed = db.Column(db.DateTime())
+    # Programs created before the compact format are stored as pickles
+    pickle = db.deferred(db.Column(db.PickleType()))
+    data = db.Column(db.LargeBinary())
+
+    # Summary of the program, so listings need not decode it
+    name = db.Column(db.String(128))
+    days = db.Column(db.Integer())
+    exercises = db.Column(db.Integer())
+    duration = db.Column(db.Integer())
+    # JSON of Program.statistics, served as is by /stats/<unique_id>.json
+    statistics = db.deferred(db.Column(db.Text()))
+
+    # Backs ordering and keyset pagination by (date_creation, id)
+    __table_args__ = (db.Index('ix_program_date_creation_id', 'date_creation', 'id'),)
+
+    def load(self, rendered=True, lazy=False):
+        """
+        Return the streprogen.Program. If rendered is False, the rendered
+        weeks are not decoded, which is cheaper. If lazy is True, each week
+        is decoded when it is first used.
+        """
+        with metrics.span('decode'):
+            if self.data is None:
+                return self.pickle._upgrade()
+            return serialization.loads(self.data, rendered=rendered, lazy=lazy)
+
+    @property
+    def program(self):
+        """
+        The rendered streprogen.Program, decoded once per instance.
+        """
+        if '_program' not in self.__dict__:
+            self._program = self.load()
+        return self._program
+
+    @program.setter
+    def program(self, program):
+        self.data = serialization.dumps(program)
+        self._program = program
+        self.set_summary(program)
+
+    def set_summary(self, program):
+        """
+        Fill the summary and statistics columns from a rendered streprogen.Program.
+        """
+        for column, value in summary(program).items():
+            setattr(self, column, value)
+
+
+def summary(program):
+    """
+    Return the summary and statistics columns of a rendered streprogen.Program.
+    """
+    statistics = getattr(program, 'statistics', None) or program._statistics()
+    return {'name': program.name[:128],
+            'days': len(program.days),
+            'exercises': len(list(program.iter_exercises())),
+            'duration': program.duration,
+            'statistics': json.dumps(statistics, separators=(',', ':'))}
+
+
+class ArchivedProgram(db.Model):
+    """
+    A program moved out of the program table after not being viewed for a
+    while, see app/archive.py. The stored column is compressed in ´payload´.
+    """
+    id = db.Column(db.Integer(), primary_key = True)
+    unique_id = db.Column(db.String(32), unique=True, index=True)
     date_creation = db.Column(db.DateTime())
     date_lastviewed = db.Column(db.DateTime())
-    pickle = db.Column(db.PickleType())
\ No newline at end of file
+    date_archived = db.Column(db.DateTime())
+    # ´data´ or ´pickle´, the column of Program the payload was stored in
+    format = db.Column(db.String(8))
+    payload = db.deferred(db.Column(db.LargeBinary()))
+
+    name = db.Column(db.String(128))
+    days = db.Column(db.Integer())
+    exercises = db.Column(db.Integer())
+    duration = db.Column(db.Integer())
+    statistics = db.deferred(db.Column(db.Text()))
+
+
+class ReservedId(db.Model):
+    """
+    Every unique_id ever given to a program, stored or archived, so a new
+    program can not reuse the id of an archived one, see add_all_with_unique_ids.
+    """
+    __tablename__ = 'reserved_id'
+    unique_id = db.Column(db.String(32), primary_key = True)
+
+
+class RenderJob(db.Model):
+    """
+    Status of an asynchronous render job, see app/jobs.py.
+    """
+    id = db.Column(db.String(32), primary_key = True)
+    status = db.Column(db.String(16))
+    unique_id = db.Column(db.String(32))
+    error = db.Column(db.String(255))
+    date_submitted = db.Column(db.DateTime())
+    date_started = db.Column(db.DateTime())
+    date_finished = db.Column(db.DateTime())
+
+
+class Checkpoint(db.Model):
+    """
+    Progress of a resumable maintenance command, see app/migrate.py.
+    """
+    name = db.Column(db.String(32), primary_key = True)
+    last_id = db.Column(db.Integer())
+    date_updated = db.Column(db.DateTime())
+
+
+class Aggregate(db.Model):
+    """
+    A counter of the analytics across all programs, e.g. the number of
+    programs with a duration of 8 weeks, see app/analytics.py.
+    """
+    metric = db.Column(db.String(32), primary_key = True)
+    key = db.Column(db.String(128), primary_key = True)
+    count = db.Column(db.Integer(), nullable = False)
+
+    # Backs the largest counters of a metric, e.g. the top exercise names
+    __table_args__ = (db.Index('ix_aggregate_metric_count', 'metric', 'count'),)
+
+
+def latest(limit=20, before=None, query=None):
+    """
+    Return the newest programs, newest first, with the program bodies
+    deferred. For keyset pagination pass ´before´, a (date_creation, id)
+    tuple of the last program on the previous page. ´query´ is a query of
+    Program to start from, e.g. in the read-only session.
+    """
+    query = (query or Program.query).options(db.defer(Program.data))
+    if before is not None:
+        date_creation, id = before
+        query = query.filter(or_(Program.date_creation < date_creation,
+                                 and_(Program.date_creation == date_creation, Program.id < id)))
+    return query.order_by(Program.date_creation.desc(), Program.id.desc()).limit(limit).all()
+
+
+def add_with_unique_id(program, length=5, attempts=10):
+    """
+    Insert and commit a models.Program with a random unique_id.
+    See add_all_with_unique_ids.
+    """
+    return add_all_with_unique_ids([program], length, attempts)[0]
+
+
+# A duplicate unique_id, as reported by SQLite and by Postgres
+ID_COLLISION = re.compile(r'UNIQUE constraint failed: (reserved_id|program)\.unique_id\b|'
+                          r'violates unique constraint '
+                          r'"(reserved_id_pkey|ix_program_unique_id|program_unique_id_key)"')
+
+
+def add_all_with_unique_ids(programs, length=5, attempts=10):
+    """
+    Insert and commit models.Programs with random unique_ids, in one transaction.
+
+    The ids are reserved in the reserved_id table, which also holds the ids
+    of archived programs, in the same transaction. Its primary key detects
+    collisions, so instead of a SELECT per candidate id the insert is
+    retried with new ids. After half the attempts have failed, longer ids
+    are used. Other integrity errors are raised.
+    """
+    for attempt in range(attempts):
+        for program in programs:
+            program.unique_id = random_string(length if attempt < attempts // 2 else length + 1)
+        db.session.add_all([ReservedId(unique_id=program.unique_id) for program in programs])
+        db.session.add_all(programs)
+        try:
+            db.session.commit()
+            return programs
+        except IntegrityError as error:
+            db.session.rollback()
+            if not ID_COLLISION.search(str(error.orig)):
+                raise
+    raise RuntimeError('Could not allocate unique_ids in {} attempts.'.format(attempts))
+
+
+def create_schema():
+    """
+    Create missing tables and upgrade existing ones, see ´flask init-db´.
+    """
+    created = set(db.metadata.tables) - set(inspect(db.engine).get_table_names())
+    db.create_all()
+    upgrade_schema()
+    if ReservedId.__tablename__ in created:
+        reserve_existing_ids()
+    from app import search
+    search.create_index()
+
+
+def upgrade_schema():
+    """
+    Add columns and indexes missing from existing tables, since
+    db.create_all() only creates tables that do not exist.
+    """
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            added.append((table.name, column.name))
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column_type)))
+
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+
+    if ('program', 'name') in added or ('program', 'statistics') in added:
+        fill_summaries()
+
+
+def reserve_existing_ids():
+    """
+    Reserve the unique_ids of the programs stored before the reserved_id table.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            'INSERT INTO reserved_id (unique_id) '
+            'SELECT unique_id FROM program WHERE unique_id IS NOT NULL '
+            'UNION SELECT unique_id FROM archived_program WHERE unique_id IS NOT NULL'))
+
+
+def fill_summaries(chunk_size=100):
+    """
+    Fill the summary and statistics columns of programs stored before
+    they existed. Programs that can not be loaded are logged and left
+    without. Returns the number of programs filled and the number that
+    could not be loaded.
+    """
+    query = (Program.query.filter(or_(Program.name.is_(None), Program.statistics.is_(None)))
+             .order_by(Program.id))
+    last_id = 0
+    filled, failed = 0, 0
+    while True:
+        programs = query.filter(Program.id > last_id).limit(chunk_size).all()
+        if not programs:
+            break
+        for program in programs:
+            try:
+                program.set_summary(program.load())
+                filled += 1
+            except Exception:
+                failed += 1
+                current_app.logger.exception('Summarizing program {} failed.'.format(program.id))
+        last_id = programs[-1].id
+        db.session.commit()
+    return filled, failed
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Search for programs by name and by the prefix of the reference code.
+
+Names are indexed with full text search: an FTS5 table kept in sync with
+the program table by triggers on SQLite, and a GIN index on the tsvector
+of the name on Postgres. Every word of the query matches as a prefix, so
+´squ ben´ finds ´Squat and bench´, which suits autocomplete. Reference
+codes are matched by prefix with a range scan of their unique index.
+
+Results are ranked with matching reference codes first, then names by
+relevance (bm25 on SQLite, ts_rank on Postgres). Without full text search,
+e.g. on a SQLite without FTS5, names are matched with LIKE.
+"""
+import re
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from app import db, read_db
+
+MAX_PER_PAGE = 50
+# Deeper pages are not useful for autocomplete, and get slower
+MAX_PAGE = 20
+
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE program_search USING fts5(name, content='program', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    "CREATE TRIGGER program_search_insert AFTER INSERT ON program BEGIN "
+    "INSERT INTO program_search(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER program_search_delete AFTER DELETE ON program BEGIN "
+    "INSERT INTO program_search(program_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER program_search_update AFTER UPDATE OF name ON program BEGIN "
+    "INSERT INTO program_search(program_search, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO program_search(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO program_search(program_search) VALUES ('rebuild')",
+]
+
+POSTGRES_SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS ix_program_name_search ON program "
+    "USING gin (to_tsvector('simple', coalesce(name, '')))",
+]
+
+COLUMNS = 'program.unique_id, program.name, program.days, program.exercises, program.duration'
+
+
+def create_index():
+    """
+    Create the full text index of the names, if it does not exist. Called
+    by models.create_schema().
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        with db.engine.connect() as connection:
+            exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'program_search'"))
+            if exists.first() is not None:
+                return
+        statements = SQLITE_SCHEMA
+    elif dialect == 'postgresql':
+        statements = POSTGRES_SCHEMA
+    else:
+        return
+    try:
+        with db.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+    except (OperationalError, ProgrammingError):
+        current_app.logger.exception('Creating the search index failed, names are matched with LIKE.')
+
+
+def words(query):
+    """
+    Return the lowercase words of a query.
+    """
+    return re.findall(r'\w+', query.lower(), re.UNICODE)[:8]
+
+
+def _id_range(query):
+    """
+    Return (low, high) such that reference codes starting with the query
+    are in [low, high], or None if the query can not be a reference code.
+    Codes only have digits and capitals, which sort before ´Z´ in any collation.
+    """
+    prefix = query.strip().upper()
+    if not re.match(r'^[A-Z0-9]{1,32}$', prefix):
+        return None
+    return prefix, prefix + 'Z' * (32 - len(prefix))
+
+
+def _name_query(dialect, terms, fts):
+    """
+    Return the SQL selecting the programs whose name matches, with a lower
+    score for better matches, and its parameters.
+    """
+    if dialect == 'sqlite' and fts:
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        return ('SELECT {}, 1 AS kind, bm25(program_search) AS score FROM program_search '
+                'JOIN program ON program.id = program_search.rowid '
+                'WHERE program_search MATCH :match'.format(COLUMNS)), {'match': match}
+    if dialect == 'postgresql':
+        tsquery = ' & '.join('{}:*'.format(term) for term in terms)
+        vector = "to_tsvector('simple', coalesce(program.name, ''))"
+        return ("SELECT {0}, 1 AS kind, -ts_rank({1}, to_tsquery('simple', :tsquery)) AS score "
+                "FROM program WHERE {1} @@ to_tsquery('simple', :tsquery)".format(COLUMNS, vector),
+                {'tsquery': tsquery})
+
+    conditions = ' AND '.join('lower(program.name) LIKE :term{}'.format(i) for i in range(len(terms)))
+    parameters = dict(('term{}'.format(i), '%{}%'.format(term)) for i, term in enumerate(terms))
+    return 'SELECT {}, 1 AS kind, 0 AS score FROM program WHERE {}'.format(COLUMNS, conditions), parameters
+
+
+_fts = {}
+
+
+def _has_fts():
+    """
+    Whether the FTS5 table exists, checked once per process.
+    """
+    if 'sqlite' not in _fts:
+        found = read_db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'program_search'"))
+        _fts['sqlite'] = found.first() is not None
+    return _fts['sqlite']
+
+
+def search(query, page=1, per_page=10):
+    """
+    Search the programs, see the module docstring.
+
+    Returns
+    -------
+    Tuple (results, more), where results is a list of dicts with the
+    unique_id, name, days, exercises and duration of the programs on the
+    page, and more is True if there are more pages.
+    """
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    page = max(1, min(int(page), MAX_PAGE))
+    terms = words(query)
+    id_range = _id_range(query)
+    if not terms and id_range is None:
+        return [], False
+
+    dialect = read_db.engine.dialect.name
+    selects, parameters = [], {}
+    if id_range is not None:
+        selects.append('SELECT {}, 0 AS kind, 0 AS score FROM program '
+                       'WHERE program.unique_id >= :low AND program.unique_id <= :high'.format(COLUMNS))
+        parameters.update(low=id_range[0], high=id_range[1])
+    if terms:
+        sql, name_parameters = _name_query(dialect, terms, dialect == 'sqlite' and _has_fts())
+        selects.append(sql)
+        parameters.update(name_parameters)
+
+    sql = ('SELECT * FROM ({}) AS results ORDER BY kind, score, unique_id '
+           'LIMIT :limit OFFSET :offset').format(' UNION ALL '.join(selects))
+    # One row more tells whether there is another page
+    parameters.update(limit=per_page + 1, offset=(page - 1) * per_page)
+    rows = read_db.execute(text(sql), parameters).fetchall()
+
+    results, seen = [], set()
+    for row in rows[:per_page]:
+        if row.unique_id in seen:
+            continue
+        seen.add(row.unique_id)
+        results.append({'unique_id': row.unique_id, 'name': row.name, 'days': row.days,
+                        'exercises': row.exercises, 'duration': row.duration})
+    return results, len(rows) > per_page
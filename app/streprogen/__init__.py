@@ -1,3 +1,6 @@
 # -*- coding: utf-8 -*-
 
 from .main import Day, StaticExercise, DynamicExercise, Program
+from .cache import RenderCache, fingerprint
+from . import serialization
+from .batch import program_from_spec, render_programs
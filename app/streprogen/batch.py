@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Create and render many programs from plain dict specs, in parallel.
+
+A spec uses the keyword arguments of Program, along with the days:
+
+    {'name': 'Group A', 'units': 'kg', 'round_to': 2.5, 'weeks': 8,
+     'nonlinearity': 10, 'intensity_list': [70, 72, ...],
+     'reps_list': [100, 90, ...], 'reps_per_exercise': 25, 'reps_RM': 'tight',
+     'days': [{'main': [{'name': 'Squat', 'current_max': 100,
+                         'desired_max': 120, 'low_reps': 3, 'high_reps': 8}],
+               'extra': [{'name': 'Abs', 'scheme': '3x10'}]}]}
+
+Specs are limited like the form: at most MAX_DURATION weeks, MAX_DAYS days
+and MAX_EXERCISES main and MAX_EXERCISES extra exercises per day.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from .main import Day, StaticExercise, DynamicExercise, Program
+
+MAX_DURATION = 12
+MAX_DAYS = 5
+MAX_EXERCISES = 5
+
+
+def program_from_spec(spec):
+    """
+    Create an unrendered Program from a spec, raising ValueError if it is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError('A program spec must be an object.')
+    spec = dict(spec)
+    days = spec.pop('days', None)
+    if not days:
+        raise ValueError('A program needs at least one day.')
+    if not isinstance(days, list) or len(days) > MAX_DAYS:
+        raise ValueError('A program has at most {} days.'.format(MAX_DAYS))
+    try:
+        # Checked before Program, which builds lists as long as the duration
+        weeks = int(spec.get('weeks', 6))
+    except (TypeError, ValueError):
+        raise ValueError('weeks must be an integer.')
+    if not 1 <= weeks <= MAX_DURATION:
+        raise ValueError('weeks must be within 1-{}.'.format(MAX_DURATION))
+
+    try:
+        program = Program(**spec)
+    except (TypeError, ValueError, AttributeError) as error:
+        raise ValueError('Invalid program settings: {}'.format(error))
+    if program.reps_RM_model not in ('normal', 'relaxed', 'tight'):
+        raise ValueError('reps_RM must be normal, relaxed or tight.')
+    if len(program.intensity_list) < program.duration or len(program.reps_list) < program.duration:
+        raise ValueError('intensity_list and reps_list need one value per week.')
+
+    for i, day_spec in enumerate(days):
+        if not isinstance(day_spec, dict):
+            raise ValueError('Day {} must be an object.'.format(i+1))
+        for kind in ('main', 'extra'):
+            if len(day_spec.get(kind, [])) > MAX_EXERCISES:
+                raise ValueError('Day {} has more than {} {} exercises.'.format(i+1, MAX_EXERCISES, kind))
+        day = Day()
+        for exercise in day_spec.get('main', []):
+            try:
+                exercise = DynamicExercise(**exercise)
+            except (TypeError, ValueError) as error:
+                raise ValueError('Invalid exercise on day {}: {}'.format(i+1, error))
+            if exercise.low_reps >= exercise.high_reps:
+                raise ValueError('low_reps must be less than high_reps for exercise "{}".'
+                                 .format(exercise.name))
+            day.add_main(exercise)
+        if not day.main_exercises:
+            raise ValueError('Day {} has no dynamic exercises.'.format(i+1))
+        for exercise in day_spec.get('extra', []):
+            try:
+                day.add_extra(StaticExercise(**exercise))
+            except TypeError as error:
+                raise ValueError('Invalid static exercise on day {}: {}'.format(i+1, error))
+        program.add_day(day)
+
+    return program
+
+
+def render_spec(spec, seed=0, engine='index'):
+    """
+    Create and render a program from a spec.
+
+    Returns
+    -------
+    Tuple (program, error), where exactly one of them is None.
+    """
+    try:
+        program = program_from_spec(spec)
+        program.render(engine=engine, seed=seed)
+    except Exception as error:
+        return None, str(error)
+    return program, None
+
+
+def render_programs(specs, processes=None, seed=0, engine='index', executor=None):
+    """
+    Create and render many programs, in parallel across processes.
+
+    Parameters
+    ----------
+    specs : List of program specs.
+    processes : Number of worker processes, by default one per core.
+                With 1, or a single spec, the programs are rendered in
+                this process.
+    seed : Seed passed to Program.render().
+    engine : Engine passed to Program.render().
+    executor : A concurrent.futures executor to render in, instead of
+               a new pool of ´processes´ processes.
+
+    Returns
+    -------
+    List with one tuple (program, error) per spec, in the same order.
+    """
+    specs = list(specs)
+    if executor is not None and len(specs) > 1:
+        return list(executor.map(render_spec, specs, [seed]*len(specs), [engine]*len(specs)))
+    if processes == 1 or len(specs) <= 1:
+        return [render_spec(spec, seed, engine) for spec in specs]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(render_spec, specs, [seed]*len(specs), [engine]*len(specs)))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache for rendered programs.
+
+Programs created with "Copy and edit" or from the examples are often
+identical. Rendering is a pure function of the program parameters, the
+dynamic exercises, the engine and the seed, so identical submissions can
+reuse the result of a prior render instead of running the stochastic
+search again.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+from .rendered import RenderedWeeks
+
+
+def fingerprint(program, seed, engine='index'):
+    """
+    Return a hex digest of everything Program.render() depends on.
+
+    The units and the names of the exercises are left out, since they only
+    show up in the formatted strings and not in the reps or weights.
+    """
+    exercises = [[[ex.current_max, ex.desired_max, ex.low_reps, ex.high_reps,
+                   None if ex.reps is None else float(ex.reps)]
+                  for ex in day.main_exercises] for day in program.days]
+    canonical = {'engine': engine,
+                 'seed': seed,
+                 'duration': program.duration,
+                 'k': program.k,
+                 'round': program.round,
+                 'intensity_list': [float(i) for i in program.intensity_list],
+                 'reps_list': [float(r) for r in program.reps_list],
+                 'reps_per_exercise': program.reps_per_exercise,
+                 'reps_RM': program.reps_RM,
+                 'exercises': exercises}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class RenderCache(object):
+    """
+    Bounded, thread safe LRU cache of render results.
+    """
+    def __init__(self, maxsize=512):
+        """
+        Parameters
+        ----------
+        maxsize : Maximum number of render results to keep.
+        """
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def render(self, program, seed=0, engine='index'):
+        """
+        Render the program, reusing an earlier result for an identical
+        program rendered with the same seed and engine.
+        """
+        key = fingerprint(program, seed, engine)
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            mode, maxima, arrays, statistics = entry
+            program._assign_ids()
+            ids = [ex.id for ex in program.iter_exercises()]
+            program.seed = seed
+            program.mode = mode
+            program.maxima = dict(zip(ids, maxima))
+            # The arrays are never modified, so programs can share them
+            program.rendered = RenderedWeeks.from_arrays(ids, program.duration, program.units, *arrays)
+            program.statistics = statistics
+            return program
+
+        program.render(engine=engine, seed=seed)
+        maxima = [program.maxima[ex.id] for ex in program.iter_exercises()]
+
+        with self._lock:
+            self._results[key] = (program.mode, maxima, program.rendered.arrays, program.statistics)
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return program
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
@@ -2,18 +2,28 @@
 
 # Imports
 from __future__ import division
-from collections import defaultdict
 import random
 import math
 import warnings
+import csv
+import functools
+import io
+import json
+import os
+import numpy as np
+from .vectorized import best_reps_batch
+from .partitions import partition_index
+from .rendered import RenderedWeeks, LazyRenderedWeeks
 
 
 class DynamicExercise(object):
     """
     Object for Dynamic Exercises.
     """
+    __slots__ = ('name', 'current_max', 'desired_max', 'low_reps', 'high_reps', 'reps', 'id')
+
     def __init__(self, name, current_max, desired_max, 
-                 low_reps = 3, high_reps = 8, reps = None):
+                 low_reps = 3, high_reps = 8, reps = None, id = None):
         """
         Initalize a new dynamic exercise.
         
@@ -25,6 +35,8 @@ class DynamicExercise(object):
         low_reps : Lowest number of reps.
         high_reps : Highest number of reps.
         reps : Total reps, if None global from program is used.
+        id : Stable id, keying the rendered results. If None, one is
+             derived from the name when the program is rendered.
         """
         self.name = name
         self.current_max = int(current_max)
@@ -32,33 +44,59 @@ class DynamicExercise(object):
         self.low_reps = int(low_reps)
         self.high_reps = int(high_reps)
         self.reps = reps
+        self.id = id
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(_get_state(self))
+
+    def __getstate__(self):
+        return _get_state(self)
+
+    def __setstate__(self, state):
+        # Exercises pickled before ´reps´ and ´id´ were added lack them
+        self.reps = None
+        self.id = None
+        _set_state(self, state)
 
 
 class StaticExercise(object):
     """
     Object for Static Exercises.
     """
+    __slots__ = ('name', 'scheme')
+
     def __init__(self, name, scheme):
         self.name = name
         self.scheme = scheme
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(_get_state(self))
+
+    def __getstate__(self):
+        return _get_state(self)
+
+    def __setstate__(self, state):
+        _set_state(self, state)
 
 
 class Day(object):
     """
     Object for Days.
     """
+    __slots__ = ('main_exercises', 'extra_exercises')
+
     def __init__(self):
         self.main_exercises = []
         self.extra_exercises = []
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(_get_state(self))
+
+    def __getstate__(self):
+        return _get_state(self)
+
+    def __setstate__(self, state):
+        _set_state(self, state)
 
     def add_main(self, exercise):
         if isinstance(exercise, list):
@@ -75,7 +113,12 @@ class Program(object):
     Object for the Program.
     """
     
-    _latex_template_path = 'latex_template.txt'
+    __slots__ = ('name', 'units', 'round', 'duration', 'nonlinearity', 'k', 'intensity_list',
+                 'intensity_model', 'reps_list', 'k_list', 'reps_model', 'reps_per_exercise',
+                 'reps_RM_model', 'reps_RM', 'days', 'rendered', 'seed', 'mode', 'maxima',
+                 'statistics')
+
+    _latex_template_path = os.path.join(os.path.dirname(__file__), 'latex_template.txt')
 
     def __init__(self, name, units = 'kg', round_to = 2.5, weeks = 6, 
                  nonlinearity = 0.1, intensity_list = None, 
@@ -139,7 +182,7 @@ class Program(object):
         else:
             self.days.append(day)
 
-    def _set_maxima(self):
+    def _set_maxima(self, rng=random):
         """
         Sets the maximum intensity (lowest number of repetitions).
         This is done prior to rendering the program, and it is done
@@ -149,72 +192,241 @@ class Program(object):
         two weeks in a row is not possible.
 
         See list_of_random.
+
+        Parameters
+        ----------
+        rng : Source of randomness, the ´random´ module or a random.Random.
         """
         self.maxima = dict()
 
         # If the mode is weekly, work up to the same intensity for the entire week
         if self.mode == 'week':
             ex = self.days[0].main_exercises[0]
-            values = list_of_random(ex.low_reps, 5, self.duration)
+            values = list_of_random(ex.low_reps, 5, self.duration, rng)
             for ex in self.iter_exercises():
-                    self.maxima[ex] = values
+                    self.maxima[ex.id] = values
 
         # If the mode is day, work up to the same intensity for the day
         if self.mode == 'day':
             for day in self.days:
                 ex = day.main_exercises[0]
-                values = list_of_random(ex.low_reps, 5, self.duration)
+                values = list_of_random(ex.low_reps, 5, self.duration, rng)
                 for ex in day.main_exercises:
-                    self.maxima[ex] = values
+                    self.maxima[ex.id] = values
 
         # If the mode is exercise, go it for every exercise
         for ex in self.iter_exercises():
-            self.maxima[ex] = list_of_random(ex.low_reps, 5, self.duration)
+            self.maxima[ex.id] = list_of_random(ex.low_reps, 5, self.duration, rng)
 
 
-    def render(self):
+    def render(self, engine='index', seed=None, lazy=False):
         """
         Render the program.
         Prior to rendering, set the mode automatically and set the maxima (max intensity).
+
+        Parameters
+        ----------
+        engine : ´index´ picks the rep schemes from every valid scheme, see
+                 render_dynamic_exercises_indexed. ´numpy´ renders every
+                 exercise-week in one batch, see render_dynamic_exercises.
+                 ´python´ renders them one by one using render_dynamic_exericse.
+        seed : Integer seed. Rendering the same program with the same seed and
+               engine gives the same result. If None, a random seed is used.
+        lazy : If True, only the maxima are set, and ´rendered´ renders a
+               week when it is first accessed, see LazyRenderedWeeks. Every
+               week is rendered with its own seed, derived from ´seed´, so the
+               result does not depend on the order the weeks are accessed in,
+               but differs from rendering with lazy False. ´statistics´ is None.
+        """
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        rng = random.Random(seed)
+
+        self._assign_ids()
+        self.mode = self._mode()
+        self._set_maxima(rng)
+
+        if lazy:
+            if engine not in ('index', 'numpy', 'python'):
+                raise ValueError('Unknown engine: {}'.format(engine))
+            ids = [mainex.id for mainex in self.iter_exercises()]
+            self.rendered = LazyRenderedWeeks(ids, self.duration, self.units,
+                                              functools.partial(self._render_week, engine, seed))
+            self.statistics = None
+            return
+
+        results = self._render_results(self._render_tasks(), engine, seed, rng)
+        self._set_rendered(results)
+        self.statistics = self._statistics()
+
+    def render_incremental(self, previous, engine='index', seed=None):
         """
+        Render the program, reusing the rendered weeks of ´previous´, typically
+        the stored program this one was edited from.
+
+        An exercise-week is reused if ´previous´ has an exercise with the same id
+        and settings, and the week has the same intensity and reps scaling.
+        Everything else is rendered. If a setting shared by all exercises
+        differs (weeks, nonlinearity, rounding, reps per exercise or reps_RM),
+        the whole program is rendered.
+
+        Returns
+        -------
+        The number of exercise-weeks rendered.
+        """
+        shared = ['duration', 'k', 'round', 'reps_per_exercise', 'reps_RM']
+        if not (getattr(previous, 'rendered', False) and
+                all(getattr(self, a) == getattr(previous, a, None) for a in shared)):
+            self.render(engine, seed)
+            return len(self._render_tasks())
+
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        rng = random.Random(seed)
+
+        self._assign_ids()
         self.mode = self._mode()
-        self._set_maxima()
-        self.rendered = [defaultdict(int) for i in range(self.duration*2)]
+        unchanged = set()
+        self.maxima = dict()
+        old = {ex.id: ex for ex in previous.iter_exercises()}
+        for ex in self.iter_exercises():
+            if ex.id in old and _settings(ex) == _settings(old[ex.id]):
+                unchanged.add(ex.id)
+                self.maxima[ex.id] = list(previous.maxima[ex.id])
+            else:
+                self.maxima[ex.id] = list_of_random(ex.low_reps, 5, self.duration, rng)
+
+        weeks = set(week for week in range(1, self.duration+1)
+                    if self.intensity_list[week-1] == previous.intensity_list[week-1] and
+                    self.reps_list[week-1] == previous.reps_list[week-1])
+
+        tasks = self._render_tasks()
+        changed = [(ex, week) for ex, week in tasks if not (ex.id in unchanged and week in weeks)]
+        rendered = dict(zip(changed, self._render_results(changed, engine, seed, rng)))
+        results = [rendered[(ex, week)] if (ex, week) in rendered else previous.rendered[week][ex.id][1]
+                   for ex, week in tasks]
+
+        self._set_rendered(results)
+        self.statistics = self._statistics()
+        return len(changed)
+
+    def _render_week(self, engine, seed, week):
+        """
+        Render a week of a lazily rendered program, using a seed derived
+        from the seed of the program and the week.
+        """
+        tasks = [(mainex, week) for mainex in self.iter_exercises()]
+        return self._render_results(tasks, engine, [seed, week],
+                                    random.Random('{}-{}'.format(seed, week)))
 
+    def iter_weeks(self):
+        """
+        Generator yielding (week, days) for every week, where days has a list
+        per day with one (reps, intensity, weights) per dynamic exercise.
+        A lazily rendered week is rendered when it is reached.
+        """
         for week in range(1, self.duration+1):
-            self.rendered[week] = defaultdict(int)
-            for i, day in enumerate(self.days):
-                for mainex in day.main_exercises:
-                    reps, intensity, weights = type(self).render_dynamic_exericse(mainex, self, week)
-                    self.rendered[week][mainex] = (' | '.join([str(r)+' x '+str(w)+self.units for r, w in zip(reps, weights)]),
-                                                   (reps, intensity, weights))
-
+            schemes = self.rendered[week].schemes()
+            yield week, [[schemes[mainex.id] for mainex in day.main_exercises]
+                         for day in self.days]
 
-    def _stats_total_lifted(self, day):
+    def _render_results(self, tasks, engine, seed, rng):
         """
-        Return statistics of total weight lifted.
+        Render the (exercise, week) pairs in ´tasks´ with an engine, see render.
         """
-        return_list = []
-        for week in range(1, self.duration+1):
-            lifted = 0
-            for mainex in day.main_exercises:
-                reps = self.rendered[week][mainex][1][0]
-                weights = self.rendered[week][mainex][1][2]
-                lifted += sum([i*j for i, j in zip(reps, weights)])
-            return_list.append(lifted)
-        return return_list
+        if engine == 'index':
+            return type(self).render_dynamic_exercises_indexed(tasks, self, rng=rng)
+        elif engine == 'numpy':
+            return type(self).render_dynamic_exercises(tasks, self,
+                                                       rng=np.random.default_rng(seed))
+        elif engine == 'python':
+            return [type(self).render_dynamic_exericse(mainex, self, week, rng)
+                    for mainex, week in tasks]
+        raise ValueError('Unknown engine: {}'.format(engine))
+
+    def _assign_ids(self):
+        """
+        Give every dynamic exercise without an id one derived from its name,
+        e.g. ´squat´ and ´squat-2´, so that an exercise keeps its id when the
+        program is edited.
+        """
+        taken = set()
+        for ex in self.iter_exercises():
+            if getattr(ex, 'id', None) is None or ex.id in taken:
+                base = ex.name.strip().lower() or 'exercise'
+                ex.id, count = base, 1
+                while ex.id in taken:
+                    count += 1
+                    ex.id = '{}-{}'.format(base, count)
+            taken.add(ex.id)
+
+    def _upgrade(self):
+        """
+        Convert programs pickled before exercises had ids, where ´rendered´
+        is a list of dicts and it and ´maxima´ are keyed by the exercises.
+        """
+        exercises = list(self.iter_exercises())
+        rendered = getattr(self, 'rendered', False)
+        if not rendered or isinstance(rendered, RenderedWeeks):
+            self._assign_ids()
+            return self
+        results = [rendered[week][mainex][1] for mainex, week in self._render_tasks()]
+        self._assign_ids()
+        if getattr(self, 'maxima', None):
+            self.maxima = {ex.id: self.maxima[ex] for ex in exercises if ex in self.maxima}
+        self._set_rendered(results)
+        return self
+
+    def _render_tasks(self):
+        """
+        Return the (exercise, week) pairs to render, week by week.
+        """
+        return [(mainex, week) for week in range(1, self.duration+1)
+                for mainex in self.iter_exercises()]
 
-    def _stats_reps_heaviest(self, exercise):
+    def _set_rendered(self, results):
         """
-        Return statistics on the number of reps on the heaviest set.
+        Populate ´rendered´ from a list of (reps, intensity, weights),
+        one for every entry in _render_tasks.
         """
-        return_list = []
-        for week in range(1, self.duration+1):
-            reps = self.rendered[week][exercise][1][0][-1]
-            return_list.append(reps)
-        return return_list
+        ids = [mainex.id for mainex in self.iter_exercises()]
+        self.rendered = RenderedWeeks(ids, self.duration, self.units, results)
 
 
+    def _statistics(self):
+        """
+        Return all statistics of the rendered program as a JSON-serializable
+        dict of series, with one entry per week. Computed once when the
+        program is rendered and stored as ´statistics´.
+        """
+        reps, intensity, weights, offsets = [np.asarray(a) for a in self.rendered.arrays]
+        starts = offsets[:-1].astype(np.intp)
+        shape = (self.duration, len(self.rendered.ids))
+        reps = reps.astype(np.int64)
+
+        # Sums over the sets of every exercise-week, in a (weeks, exercises) grid
+        lifted = np.add.reduceat(reps * weights, starts).reshape(shape)
+        weighted = np.add.reduceat(reps * intensity, starts).reshape(shape)
+        reps_sum = np.add.reduceat(reps, starts).reshape(shape)
+        # Sets are sorted by descending reps, so the heaviest set is the last one
+        heaviest = reps[offsets[1:].astype(np.intp) - 1].reshape(shape)
+
+        total_lifted, first = [], 0
+        for day in self.days:
+            last = first + len(day.main_exercises)
+            total_lifted.append(_numbers(lifted[:, first:last].sum(axis=1)))
+            first = last
+
+        week_reps = reps_sum.sum(axis=1)
+        average = weighted.sum(axis=1) / np.maximum(week_reps, 1)
+        return {'weeks': list(range(1, self.duration+1)),
+                'total_lifted': total_lifted,
+                'reps_heaviest': heaviest.T.tolist(),
+                'tonnage': _numbers(lifted.sum(axis=1)),
+                'average_intensity': [round(a, 1) if r else 0 for a, r in zip(average.tolist(), week_reps.tolist())],
+                'reps': week_reps.tolist()}
 
     def print_it(self):
         """
@@ -226,7 +438,7 @@ class Program(object):
             for i, day in enumerate(self.days):
                 print('Day {}'.format(i+1))
                 for mainex in day.main_exercises:
-                    print(mainex.name, self.rendered[week][mainex][0])
+                    print(mainex.name, self.rendered[week][mainex.id][0])
             print('')
 
 
@@ -235,7 +447,16 @@ class Program(object):
         """
         Representation of a program. For debugging.
         """
-        return str(self.__dict__)
+        return str(_get_state(self))
+
+    def __getstate__(self):
+        return _get_state(self)
+
+    def __setstate__(self, state):
+        # Programs created before ´reps_per_exercise´ called it ´reps_per_week´
+        if isinstance(state, dict) and 'reps_per_week' in state:
+            state = dict(state, reps_per_exercise=state['reps_per_week'])
+        _set_state(self, state)
 
     def iter_exercises(self):
         """
@@ -264,14 +485,18 @@ class Program(object):
                 return 'exercise'
         return 'day'
     
-    def to_latex(self):
+    def iter_latex(self):
+        """
+        Generator yielding the LaTeX document in chunks, week by week.
+        """
         SEP = '&'
-        return_string = ''
-    
+        head, tail = latex_template().split('CONTENTHERE')
+        yield head
+
         # ------------
         # -- HEADER
         # ------------
-        return_string += '\section*{' + self.name +'}\n'
+        return_string = '\section*{' + self.name +'}\n'
     
         return_string += '\\begin{tabular}{l|llll} \n \
         \\textbf{Exercise} & \\textbf{Initial} & \\textbf{Final} \
@@ -286,45 +511,101 @@ class Program(object):
                                           mainex.low_reps, 
                                           mainex.high_reps]]) + '\\\ \n'
         
-    
-    
         return_string += '\end{tabular} \n'
+        yield return_string.replace(self.units, '')
         
         # ------------
         # -- Body
         # ------------
         
         for week in range(1, self.duration+1):
-            return_string += '\section*{Week ' + str(week) + '}\n'
+            return_string = '\section*{Week ' + str(week) + '}\n'
+            # Strings are formatted once per cell, and kept
+            rendered = self.rendered[week]
+            formatted, week_sets = rendered.formatted(), rendered.sets()
         
             for i, day in enumerate(self.days):
                 return_string += '\subsection*{Day ' + str(i+1) + '}\n'
-                table_width = max(self.rendered[week][mainex][0].count('|')
-                for mainex in day.main_exercises) + 1
+                sets = [week_sets[mainex.id] for mainex in day.main_exercises]
+                if not sets:
+                    # Only static exercises, which are not in the tables
+                    continue
+                table_width = max(sets)
                 
                 if table_width >= 7:
                     warnings.warn('Table width may overflow in LaTeX.')
                     
                 return_string += '\\begin{tabular}{l|' + 'l'*table_width + '}\n \\textbf{Exercise} & \\textbf{Reps} \\\ \hline \n'
             
-                for mainex in day.main_exercises:
-                    missing = table_width - self.rendered[week][mainex][0].count('|') -1
+                for mainex, num_sets in zip(day.main_exercises, sets):
+                    missing = table_width - num_sets
                     return_string += (mainex.name + SEP + 
-                                      self.rendered[week][mainex][0].replace('|', SEP) + SEP*missing + '\\\ \n')
+                                      formatted[mainex.id].replace('|', SEP) + SEP*missing + '\\\ \n')
                     
                 return_string += '\end{tabular} \n'
-           
-            
-        with open(self._latex_template_path, 'r', encoding = 'utf-8') as file:
-            latex_code = '\n'.join(list(line.strip() for line in file))
-            return_string = return_string.replace(self.units, '')
-            return latex_code.replace('CONTENTHERE', return_string)
-        print (return_string.replace(self.units, ''))
-        
+            yield return_string.replace(self.units, '')
 
+        yield tail
+
+    def to_latex(self):
+        """
+        Return the program as a LaTeX document.
+        """
+        return ''.join(self.iter_latex())
+
+    def iter_csv(self, header=True):
+        """
+        Generator yielding the program as CSV in chunks, one week at a time,
+        with one row per set.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if header:
+            writer.writerow(['week', 'day', 'exercise', 'set', 'reps', 'intensity', 'weight', 'units'])
+
+        for week, days in self.iter_weeks():
+            for i, (day, schemes) in enumerate(zip(self.days, days)):
+                for mainex, (reps, intensity, weights) in zip(day.main_exercises, schemes):
+                    for s, (r, inten, w) in enumerate(zip(reps, intensity, weights)):
+                        writer.writerow([week, i+1, mainex.name, s+1, r, inten, w, self.units])
+                for extraex in day.extra_exercises:
+                    writer.writerow([week, i+1, extraex.name, '', extraex.scheme, '', '', ''])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def iter_json(self):
+        """
+        Generator yielding the program as a JSON document in chunks,
+        one week at a time.
+        """
+        settings = {'name': self.name,
+                    'units': self.units,
+                    'round': self.round,
+                    'duration': self.duration,
+                    'days': [{'main': [{'name': ex.name,
+                                        'current_max': ex.current_max,
+                                        'desired_max': ex.desired_max,
+                                        'low_reps': ex.low_reps,
+                                        'high_reps': ex.high_reps} for ex in day.main_exercises],
+                              'extra': [{'name': ex.name, 'scheme': ex.scheme}
+                                        for ex in day.extra_exercises]}
+                             for day in self.days]}
+        yield json.dumps(settings)[:-1] + ', "weeks": ['
+
+        for week, schemes in self.iter_weeks():
+            days = [[{'name': mainex.name,
+                      'reps': reps,
+                      'intensity': intensity,
+                      'weights': weights}
+                     for mainex, (reps, intensity, weights) in zip(day.main_exercises, day_schemes)]
+                    for day, day_schemes in zip(self.days, schemes)]
+            yield (', ' if week > 1 else '') + json.dumps({'week': week, 'days': days})
+
+        yield ']}'
 
     @staticmethod
-    def render_dynamic_exericse(exercise, program, week):
+    def render_dynamic_exericse(exercise, program, week, rng=random):
         """
         Stand-alone function for rendering.
         
@@ -332,7 +613,7 @@ class Program(object):
         reps, intensities and weights for a given dynamic
         exercise in a given week.
         """
-        low_reps = program.maxima[exercise][week-1]
+        low_reps = program.maxima[exercise.id][week-1]
         high_reps = exercise.high_reps
         
         # Set the reps based on the exercise, or globally fromt he program
@@ -347,12 +628,9 @@ class Program(object):
         # Going from render_times = 1 to render_times = 10 halves the total error,
         # going to 25 seems to be a reasonable compromise.
         for s in range(render_times):
-            reps = create_reps(low_reps, high_reps, reps_total)
+            reps = create_reps(low_reps, high_reps, reps_total, rng)
             intensity = [program.reps_RM[rep] for rep in reps]
-            err_1 = abs(get_MI(reps, intensity) - desired_MI) # Deviation from MI
-            err_2 = 100*loss_measure(reps) # Spread of the reps
-            err_3 = abs(low_reps - min(reps)) # Punishes staying away from low reps
-            error = err_1 + err_2 + err_3
+            error = rep_scheme_error(reps, intensity, desired_MI, low_reps)
             suggestions.append((reps, intensity, error))
     
         # Choose the rep string with the minimum error
@@ -364,6 +642,68 @@ class Program(object):
 
         return reps, intensity, weights
 
+    @staticmethod
+    def render_dynamic_exercises_indexed(tasks, program, top_k=3, rng=random):
+        """
+        Render every (exercise, week) pair in ´tasks´ by looking up the rep
+        schemes with the lowest error among all valid schemes, see
+        partitions.py. One of the ´top_k´ best is picked at random, for
+        some variety. Tasks without an index are rendered with
+        render_dynamic_exericse. Returns a list with one tuple of reps,
+        intensities and weights per task.
+        """
+        results = []
+        for exercise, week in tasks:
+            low_reps = program.maxima[exercise.id][week-1]
+            reps = program.reps_per_exercise if exercise.reps is None else exercise.reps
+            reps_total = int(reps * (program.reps_list[week-1]/100))
+            index = partition_index(low_reps, exercise.high_reps, reps_total)
+            if index is None:
+                results.append(Program.render_dynamic_exericse(exercise, program, week, rng))
+                continue
+
+            reps, intensity, error = index.choose(program.reps_RM, program.intensity_list[week-1],
+                                                  top_k, rng)
+            current_max = S(program.k, week, exercise.desired_max,
+                            exercise.current_max, 1, program.duration)
+            weights = [round_to_nearest((inten/100)*current_max, program.round) for inten in intensity]
+            results.append((reps, intensity, weights))
+        return results
+
+    @staticmethod
+    def render_dynamic_exercises(tasks, program, render_times=25, rng=None):
+        """
+        Batched version of render_dynamic_exericse.
+
+        Renders every (exercise, week) pair in ´tasks´ at once, drawing all
+        the candidate rep schemes as NumPy arrays and scoring them with
+        the same error function. Returns a list with one tuple of
+        reps, intensities and weights per task.
+        """
+        if not tasks:
+            return []
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+
+        low, high, num, desired_MI = [], [], [], []
+        for exercise, week in tasks:
+            low.append(program.maxima[exercise.id][week-1])
+            high.append(exercise.high_reps)
+            reps = program.reps_per_exercise if exercise.reps is None else exercise.reps
+            num.append(int(reps * (program.reps_list[week-1]/100)))
+            desired_MI.append(program.intensity_list[week-1])
+
+        best = best_reps_batch(low, high, num, desired_MI, program.reps_RM,
+                               render_times, rng)
+
+        results = []
+        for (exercise, week), (reps, intensity, error) in zip(tasks, best):
+            current_max = S(program.k, week, exercise.desired_max,
+                            exercise.current_max, 1, program.duration)
+            weights = [round_to_nearest((inten/100)*current_max, program.round) for inten in intensity]
+            results.append((reps, intensity, weights))
+        return results
+
 
 
 
@@ -401,6 +741,55 @@ class Program(object):
 
 
 
+
+
+_latex_template = None
+
+def latex_template():
+    """
+    Return the LaTeX template, read once and cached.
+    """
+    global _latex_template
+    if _latex_template is None:
+        with open(Program._latex_template_path, 'r', encoding = 'utf-8') as file:
+            _latex_template = '\n'.join(list(line.strip() for line in file))
+    return _latex_template
+
+
+def _get_state(obj):
+    """
+    Return the attributes of a slotted object that are set, as a dict.
+    """
+    return dict((name, getattr(obj, name)) for name in obj.__slots__ if hasattr(obj, name))
+
+
+def _set_state(obj, state):
+    """
+    Restore the attributes of a slotted object from _get_state. Objects
+    pickled before the classes had __slots__ have their __dict__ as state,
+    attributes which no longer exist are dropped.
+    """
+    if isinstance(state, tuple):
+        # (__dict__, slots), as pickled by the default protocol
+        state = dict(state[0] or {}, **(state[1] or {}))
+    for name, value in state.items():
+        if name in obj.__slots__:
+            setattr(obj, name, value)
+
+
+def _numbers(array):
+    """
+    Return an array as a list, with integral floats as int (as round_to_nearest).
+    """
+    return [int(x) if x % 1 == 0 else x for x in array.tolist()]
+
+
+def _settings(exercise):
+    """
+    The settings of a dynamic exercise that rendering depends on.
+    """
+    return (exercise.current_max, exercise.desired_max, exercise.low_reps,
+            exercise.high_reps, getattr(exercise, 'reps', None))
 
 
 def loss_measure(iterable):
@@ -415,6 +804,16 @@ def loss_measure(iterable):
 
 
 
+def rep_scheme_error(reps, intensity, desired_MI, low_reps):
+    """
+    The error of a rep scheme, the lower the better.
+    """
+    err_1 = abs(get_MI(reps, intensity) - desired_MI) # Deviation from MI
+    err_2 = 100*loss_measure(reps) # Spread of the reps
+    err_3 = abs(low_reps - min(reps)) # Punishes staying away from low reps
+    return err_1 + err_2 + err_3
+
+
 def to_list(inputvalue):
     """
     Takes a string to a list, separated by commas.
@@ -451,27 +850,29 @@ def round_to_nearest(number, nearest):
         return rounded
 
 
-def list_of_random(low, high, num):
+def list_of_random(low, high, num, rng=random):
     """
     Create a list with NUM integers between LOW and HIGH,
     such that no two adjacent numbers are the same.
+    RNG is the source of randomness, e.g. a random.Random.
     """
     if abs(low-high) < 1:
         return [low for i in range(num)]
-    return_list = [random.randint(low, high)]
+    return_list = [rng.randint(low, high)]
 
     for i in range(num-1):
-        try_value = random.randint(low, high)
+        try_value = rng.randint(low, high)
         while try_value == return_list[i]:
-            try_value = random.randint(low, high)
+            try_value = rng.randint(low, high)
         return_list.append(try_value)
     
     return return_list
 
 
-def create_reps(low, high, num):
+def create_reps(low, high, num, rng=random):
     """
     Return a sorted list of NUM repetitions between LOW and HIGH.
+    RNG is the source of randomness, e.g. a random.Random.
     """
     return_list = []
     taken = 0
@@ -479,7 +880,7 @@ def create_reps(low, high, num):
         if (num - taken) <= high and (num - taken) >= low:
             return_list.append(num - taken)
             break
-        new = random.randint(low, high)
+        new = rng.randint(low, high)
         taken += new
         return_list.append(new)
         if taken > num:
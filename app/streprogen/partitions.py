@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Index of every rep scheme for a (low, high, total) key.
+
+create_reps draws a random descending list of reps between ´low´ and
+´high´ summing to ´total´ (or a little more, when the last set drawn
+overshoots), and rendering keeps the best of 25 draws. Reps are at most
+10 and totals are small, so the valid schemes can instead be listed once.
+The index stores them with the parts of the error that do not depend on
+the week (spread of the reps and distance from low reps), and the MI per
+reps_RM table is computed on first use. Picking a scheme is then a
+vectorized lookup over all of them.
+
+Keys with too many schemes, or none, have no index, and rendering
+falls back to sampling with create_reps.
+"""
+
+from __future__ import division
+from functools import lru_cache
+import numpy as np
+
+# Larger keys (e.g. low reps 1 and a total above about 40) fall back to sampling
+MAX_PARTITIONS = 20000
+
+
+@lru_cache(maxsize=None)
+def count_partitions(total, low, high):
+    """
+    Number of descending lists of integers in [low, high] summing to total.
+    """
+    if total == 0:
+        return 1
+    return sum(count_partitions(total - part, low, part)
+               for part in range(low, min(high, total) + 1))
+
+
+def iter_partitions(total, low, high):
+    """
+    Yield every descending tuple of integers in [low, high] summing to total.
+    """
+    if total == 0:
+        yield ()
+        return
+    for part in range(min(high, total), low - 1, -1):
+        for rest in iter_partitions(total - part, low, part):
+            yield (part,) + rest
+
+
+def iter_schemes(total, low, high):
+    """
+    Yield every rep scheme for a key, as a descending tuple: every partition
+    of total into integers in [low, high], and every scheme where create_reps
+    overshoots the total because the reps left were fewer than ´low´.
+    """
+    for scheme in iter_partitions(total, low, high):
+        yield scheme
+
+    seen = set()
+    for short in range(1, min(low - 1, total) + 1):
+        for prefix in iter_partitions(total - short, low, high):
+            # Otherwise create_reps ends with ´short´ + prefix[0] reps instead
+            if prefix and prefix[0] <= high - short:
+                continue
+            for last in range(low, high + 1):
+                scheme = tuple(sorted(prefix + (last,), reverse=True))
+                if scheme not in seen:
+                    seen.add(scheme)
+                    yield scheme
+
+
+def count_schemes(total, low, high):
+    """
+    Upper bound on the number of schemes yielded by iter_schemes.
+    """
+    shorts = range(1, min(low - 1, total) + 1)
+    return (count_partitions(total, low, high) +
+            (high - low + 1) * sum(count_partitions(total - short, low, high) for short in shorts))
+
+
+class PartitionIndex(object):
+    """
+    All rep schemes for one (low, high, total) key, see the module docstring.
+    """
+    def __init__(self, low, high, total):
+        schemes = list(iter_schemes(total, low, high))
+        sets = max([len(scheme) for scheme in schemes] + [1])
+        # Zero padded array of shape (schemes, sets)
+        self.reps = np.zeros((len(schemes), sets), dtype=np.int16)
+        for i, scheme in enumerate(schemes):
+            self.reps[i, :len(scheme)] = scheme
+        self.sets = np.array([len(scheme) for scheme in schemes])
+
+        # Spread of the reps, see loss_measure
+        first = self.reps[:, 0].astype(np.float64)
+        smallest = np.array([scheme[-1] for scheme in schemes], dtype=np.float64)
+        steps = np.where(self.reps[:, 1:] > 0, self.reps[:, :-1] - self.reps[:, 1:], 0)
+        worst = (first - smallest) ** 2
+        loss = np.where(worst == 0, 1, (steps.astype(np.float64) ** 2).sum(axis=1) / np.maximum(worst, 1))
+
+        # The error terms which are the same every week
+        self.base_error = 100 * loss + np.abs(low - smallest)
+        self._MI = {}
+
+    def __len__(self):
+        return len(self.reps)
+
+    def MI(self, reps_RM):
+        """
+        Average intensity of every scheme, for the reps_RM table of a program.
+        """
+        key = tuple(reps_RM[1:])
+        MI = self._MI.get(key)
+        if MI is None:
+            table = np.array((0,) + key, dtype=np.float64)
+            MI = (self.reps * table[self.reps]).sum(axis=1) / self.reps.sum(axis=1)
+            self._MI[key] = MI
+        return MI
+
+    def choose(self, reps_RM, desired_MI, top_k=1, rng=None):
+        """
+        Return (reps, intensity, error) of one of the ´top_k´ schemes with
+        the lowest error, picked with rng.choice if given.
+        """
+        error = np.abs(self.MI(reps_RM) - desired_MI) + self.base_error
+        top_k = min(top_k, len(error))
+        if top_k == 1:
+            best = [int(np.argmin(error))]
+        else:
+            best = np.argpartition(error, top_k - 1)[:top_k]
+            best = sorted(best.tolist(), key=lambda i: (error[i], i))
+        chosen = rng.choice(best) if rng is not None else best[0]
+
+        reps = self.reps[chosen, :self.sets[chosen]].tolist()
+        intensity = [reps_RM[rep] for rep in reps]
+        return reps, intensity, float(error[chosen])
+
+
+@lru_cache(maxsize=1024)
+def partition_index(low, high, total):
+    """
+    Return the PartitionIndex of a key, built on first use, or None if the
+    key has no rep schemes or more than MAX_PARTITIONS of them.
+    """
+    if low < 1 or high < low or total < 1:
+        return None
+    if not 0 < count_schemes(total, low, high) <= MAX_PARTITIONS:
+        return None
+    index = PartitionIndex(low, high, total)
+    return index if len(index) else None
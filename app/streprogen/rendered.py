@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage of the rendered weeks of a program.
+
+Every exercise-week (a cell) is a rep scheme: lists of reps, intensities
+and weights, one entry per set. Instead of Python lists and a formatted
+string per cell, the sets of all cells are stored in flat typed arrays,
+in the order of Program._render_tasks() (week by week, and within a week
+in the order of Program.iter_exercises()), with the start of every cell
+in ´offsets´. The strings shown on the pages are formatted when a cell is
+first accessed, and kept. Whole weeks are read with RenderedWeek.schemes(),
+which converts the arrays of the week in one pass.
+
+Indexing works as before, program.rendered[week][exercise_id] is a cell
+where cell[0] is the formatted string and cell[1] the tuple
+(reps, intensity, weights) of lists.
+"""
+
+from array import array
+
+
+def format_scheme(reps, weights, units):
+    """
+    Return a rep scheme as shown on the pages, e.g. ´5 x 80kg | 3 x 90kg´.
+    """
+    return ' | '.join([str(r)+' x '+str(w)+units for r, w in zip(reps, weights)])
+
+
+class RenderedWeeks(object):
+    """
+    The rendered weeks of a program, backed by flat arrays.
+    """
+    __slots__ = ('ids', 'duration', 'units', 'reps', 'intensity', 'weights', 'offsets', '_positions',
+                 '_formatted', '_sets')
+
+    def __init__(self, ids, duration, units, results):
+        """
+        Parameters
+        ----------
+        ids : The ids of the dynamic exercises, in the order of Program.iter_exercises().
+        duration : Number of weeks.
+        units : Units, appended to the weights when formatting.
+        results : List of (reps, intensity, weights), one per exercise-week,
+                  in the order of Program._render_tasks().
+        """
+        reps, intensity, weights, offsets = array('B'), array('d'), array('d'), array('I', [0])
+        for r, i, w in results:
+            reps.extend(r)
+            intensity.extend(i)
+            weights.extend(w)
+            offsets.append(len(reps))
+        self._set(ids, duration, units, reps, intensity, weights, offsets)
+
+    @classmethod
+    def from_arrays(cls, ids, duration, units, reps, intensity, weights, offsets):
+        """
+        Create from arrays as in ´arrays´, e.g. NumPy arrays, which are
+        used without copying.
+        """
+        rendered = cls.__new__(cls)
+        rendered._set(ids, duration, units, reps, intensity, weights, offsets)
+        return rendered
+
+    def _set(self, ids, duration, units, reps, intensity, weights, offsets):
+        if len(offsets) != len(ids) * duration + 1:
+            raise ValueError('Expected {} rendered exercise-weeks, got {}.'
+                             .format(len(ids) * duration, len(offsets) - 1))
+        self.ids = list(ids)
+        self.duration = duration
+        self.units = units
+        self.reps, self.intensity, self.weights, self.offsets = reps, intensity, weights, offsets
+        self._positions = dict((exercise_id, i) for i, exercise_id in enumerate(self.ids))
+        self._formatted = [None] * (len(offsets) - 1)
+        self._sets = None
+
+    @property
+    def arrays(self):
+        """
+        The tuple (reps, intensity, weights, offsets) of arrays.
+        """
+        return self.reps, self.intensity, self.weights, self.offsets
+
+    def __len__(self):
+        return self.duration
+
+    def __getitem__(self, week):
+        """
+        Return the 1-indexed week, which is indexed by exercise ids.
+        """
+        if not 1 <= week <= self.duration:
+            raise IndexError('Week {} is not rendered.'.format(week))
+        return RenderedWeek(self, week)
+
+    def __getstate__(self):
+        return (self.ids, self.duration, self.units) + self.arrays
+
+    def __setstate__(self, state):
+        self._set(*state)
+
+    def scheme(self, cell):
+        """
+        Return (reps, intensity, weights) of a cell, by its position in
+        Program._render_tasks().
+        """
+        start, end = self.offsets[cell], self.offsets[cell+1]
+        # Same as round_to_nearest, integers are returned as int
+        weights = [int(w) if w % 1 == 0 else w for w in self.weights[start:end].tolist()]
+        return self.reps[start:end].tolist(), self.intensity[start:end].tolist(), weights
+
+    def schemes(self, first=0, last=None):
+        """
+        Return the list of (reps, intensity, weights) of the cells from
+        ´first´ up to ´last´, by default every cell, converting the arrays
+        in one pass.
+        """
+        last = len(self.offsets) - 1 if last is None else last
+        start = self.offsets[first]
+        offsets = [int(offset) - start for offset in self.offsets[first:last+1]]
+        end = start + offsets[-1]
+        reps = self.reps[start:end].tolist()
+        intensity = self.intensity[start:end].tolist()
+        weights = [int(w) if w % 1 == 0 else w for w in self.weights[start:end].tolist()]
+        return [(reps[a:b], intensity[a:b], weights[a:b]) for a, b in zip(offsets, offsets[1:])]
+
+    def formatted(self, cell):
+        """
+        Return the formatted string of a cell. The cells of its week are
+        formatted together on first access.
+        """
+        string = self._formatted[cell]
+        if string is None:
+            first = cell - cell % len(self.ids)
+            last = first + len(self.ids)
+            self._formatted[first:last] = [format_scheme(reps, weights, self.units)
+                                           for reps, intensity, weights in self.schemes(first, last)]
+            string = self._formatted[cell]
+        return string
+
+
+class RenderedWeek(object):
+    """
+    A rendered week, returning the cell of an exercise by its id.
+    """
+    __slots__ = ('_weeks', '_start')
+
+    def __init__(self, weeks, week):
+        self._weeks = weeks
+        self._start = (week - 1) * len(weeks.ids)
+
+    def __getitem__(self, exercise_id):
+        return RenderedCell(self._weeks, self._start + self._weeks._positions[exercise_id])
+
+    def sets(self):
+        """
+        Return a dict of the number of sets of every exercise of the week by exercise id.
+        """
+        weeks, start = self._weeks, self._start
+        if weeks._sets is None:
+            offsets = [int(offset) for offset in weeks.offsets]
+            weeks._sets = [b - a for a, b in zip(offsets, offsets[1:])]
+        return dict(zip(weeks.ids, weeks._sets[start:start + len(weeks.ids)]))
+
+    def formatted(self):
+        """
+        Return a dict of the formatted string of every exercise of the week by exercise id.
+        """
+        weeks, start = self._weeks, self._start
+        if not weeks.ids:
+            return {}
+        weeks.formatted(start)
+        return dict(zip(weeks.ids, weeks._formatted[start:start + len(weeks.ids)]))
+
+    def schemes(self):
+        """
+        Return a dict of the (reps, intensity, weights) of every exercise
+        of the week by exercise id.
+        """
+        weeks = self._weeks
+        return dict(zip(weeks.ids, weeks.schemes(self._start, self._start + len(weeks.ids))))
+
+
+class RenderedCell(object):
+    """
+    A rendered exercise-week. cell[0] is the formatted string and cell[1]
+    the tuple (reps, intensity, weights).
+    """
+    __slots__ = ('_weeks', '_cell')
+
+    def __init__(self, weeks, cell):
+        self._weeks = weeks
+        self._cell = cell
+
+    def __getitem__(self, item):
+        if item == 0:
+            return self._weeks.formatted(self._cell)
+        if item == 1:
+            return self._weeks.scheme(self._cell)
+        raise IndexError('A rendered exercise-week has two items.')
+
+
+class LazyRenderedWeeks(object):
+    """
+    Rendered weeks that are computed (or decoded) on first access, one week
+    at a time. Indexes like RenderedWeeks, and ´arrays´ materializes every
+    week. Pickles as the RenderedWeeks of every week.
+    """
+    __slots__ = ('ids', 'duration', 'units', '_render_week', '_weeks', '_all')
+
+    def __init__(self, ids, duration, units, render_week):
+        """
+        Parameters
+        ----------
+        ids : The ids of the dynamic exercises, in the order of Program.iter_exercises().
+        duration : Number of weeks.
+        units : Units, appended to the weights when formatting.
+        render_week : Function of a week (1-indexed), returning a list with
+                      one (reps, intensity, weights) per exercise.
+        """
+        self.ids = list(ids)
+        self.duration = duration
+        self.units = units
+        self._render_week = render_week
+        self._weeks = {}
+        # Every week, once materialized
+        self._all = None
+
+    def __len__(self):
+        return self.duration
+
+    def __getitem__(self, week):
+        if not 1 <= week <= self.duration:
+            raise IndexError('Week {} is not rendered.'.format(week))
+        if self._all is not None:
+            return self._all[week]
+        weeks = self._weeks.get(week)
+        if weeks is None:
+            weeks = self._weeks[week] = RenderedWeeks(self.ids, 1, self.units, self._render_week(week))
+        return weeks[1]
+
+    def __reduce__(self):
+        return RenderedWeeks.from_arrays, (self.ids, self.duration, self.units) + self.arrays
+
+    @property
+    def rendered_weeks(self):
+        """
+        The weeks which have been rendered so far.
+        """
+        if self._all is not None:
+            return list(range(1, self.duration+1))
+        return sorted(self._weeks)
+
+    def materialize(self):
+        """
+        Render every week, and return them as a RenderedWeeks.
+        """
+        if self._all is None:
+            results = []
+            for week in range(1, self.duration+1):
+                self[week]
+                results.extend(self._weeks[week].schemes())
+            self._all = RenderedWeeks(self.ids, self.duration, self.units, results)
+            self._weeks = {}
+        return self._all
+
+    @property
+    def arrays(self):
+        return self.materialize().arrays
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Compact, versioned binary format for programs and their rendered weeks.
+
+Layout (all integers little-endian):
+
+    magic       4 bytes, b'SPG' followed by the format version
+    header_len  uint32
+    header      UTF-8 JSON with the program settings, days and maxima
+    weeks       uint32, number of rendered weeks
+    offsets     uint32 * (weeks + 1), start of each week relative to the
+                first week, the last entry is the end of the last week
+    week blocks one per week, columnar over the exercises in the order of
+                Program.iter_exercises() (the integer exercise ids):
+                    sets    uint8 * exercises
+                    reps    uint8 * sum(sets)
+                    weights int32 * sum(sets), in multiples of ´round´
+
+Intensities are not stored, since they are looked up from ´reps_RM´ by the
+reps, and the ´rendered´ strings are rebuilt from reps, weights and units.
+The header and any single week can be decoded without reading the rest.
+"""
+
+from __future__ import division
+import functools
+import json
+import struct
+import numpy as np
+
+from .main import Day, StaticExercise, DynamicExercise, Program, S
+from .rendered import RenderedWeeks, LazyRenderedWeeks
+
+VERSION = 1
+MAGIC = b'SPG' + struct.pack('<B', VERSION)
+
+_UINT32 = struct.Struct('<I')
+
+
+def dumps(program):
+    """
+    Encode a (rendered) program as bytes.
+    """
+    exercises = list(program.iter_exercises())
+    header = {'name': program.name,
+              'units': program.units,
+              'round': program.round,
+              'duration': program.duration,
+              'nonlinearity': program.nonlinearity,
+              'k': program.k,
+              'intensity_list': program.intensity_list,
+              'intensity_model': program.intensity_model,
+              'reps_list': program.reps_list,
+              'reps_model': program.reps_model,
+              # Programs created before ´reps_per_exercise´ called it ´reps_per_week´
+              'reps_per_exercise': getattr(program, 'reps_per_exercise',
+                                           getattr(program, 'reps_per_week', None)),
+              'reps_RM_model': program.reps_RM_model,
+              'reps_RM': program.reps_RM,
+              'mode': getattr(program, 'mode', None),
+              'seed': getattr(program, 'seed', None),
+              'days': [{'main': [[ex.name, ex.current_max, ex.desired_max, ex.low_reps,
+                                  ex.high_reps, getattr(ex, 'reps', None), getattr(ex, 'id', None)]
+                                 for ex in day.main_exercises],
+                        'extra': [[ex.name, ex.scheme] for ex in day.extra_exercises]}
+                       for day in program.days]}
+    if program.rendered:
+        header['maxima'] = [list(program.maxima[ex.id]) for ex in exercises]
+
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    blocks = []
+    if program.rendered:
+        # The rendered arrays are in the same order as the week blocks
+        reps, intensity, weights, offsets = [np.asarray(a) for a in program.rendered.arrays]
+        sets = np.diff(offsets).astype('<u1')
+        reps = reps.astype('<u1')
+        multiples = np.round(weights / program.round).astype('<i4')
+        cells = len(exercises)
+        for week in range(program.duration):
+            first, last = offsets[week*cells], offsets[(week+1)*cells]
+            blocks.append(sets[week*cells:(week+1)*cells].tobytes() +
+                          reps[first:last].tobytes() + multiples[first:last].tobytes())
+
+    offsets = [0]
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+
+    return b''.join([MAGIC, _UINT32.pack(len(header)), header,
+                     _UINT32.pack(len(blocks)),
+                     np.array(offsets, dtype='<u4').tobytes()] + blocks)
+
+
+def _read_header(data):
+    """
+    Return the decoded header and the position right after it.
+    """
+    data = memoryview(data)
+    if bytes(data[:3]) != MAGIC[:3]:
+        raise ValueError('Not an encoded program.')
+    version = data[3]
+    if version != VERSION:
+        raise ValueError('Unsupported program format version: {}'.format(version))
+    length, = _UINT32.unpack_from(data, 4)
+    start = 4 + _UINT32.size
+    header = json.loads(bytes(data[start:start+length]).decode('utf-8'))
+    return header, start + length
+
+
+def loads_header(data):
+    """
+    Decode only the header: the program settings, days and maxima.
+    """
+    return _read_header(data)[0]
+
+
+def _read_arrays(data, header, position, week):
+    """
+    Return the arrays (sets, reps, multiples of ´round´) of a week (1-indexed).
+    """
+    weeks, = _UINT32.unpack_from(data, position)
+    if not 1 <= week <= weeks:
+        raise IndexError('Week {} is not rendered.'.format(week))
+    offsets = np.frombuffer(data, dtype='<u4', count=weeks+1, offset=position+_UINT32.size)
+    start = position + _UINT32.size*(weeks+2) + int(offsets[week-1])
+
+    exercises = sum(len(day['main']) for day in header['days'])
+    sets = np.frombuffer(data, dtype='<u1', count=exercises, offset=start)
+    total = int(sets.sum())
+    reps = np.frombuffer(data, dtype='<u1', count=total, offset=start+exercises)
+    multiples = np.frombuffer(data, dtype='<i4', count=total, offset=start+exercises+total)
+    return sets, reps, multiples
+
+
+def _read_week(data, header, position, week):
+    """
+    Decode a week (1-indexed) into a list with one tuple of
+    reps, intensities and weights per exercise.
+    """
+    sets, reps, multiples = _read_arrays(data, header, position, week)
+    reps = reps.tolist()
+
+    # Same as round_to_nearest, integers are returned as int
+    reps_RM = header['reps_RM']
+    weights = [int(w) if w % 1 == 0 else w for w in (multiples * header['round']).tolist()]
+
+    schemes = []
+    end = 0
+    for count in sets.tolist():
+        start, end = end, end + count
+        schemes.append((reps[start:end], [reps_RM[r] for r in reps[start:end]], weights[start:end]))
+    return schemes
+
+
+def loads_week(data, week):
+    """
+    Decode a single week (1-indexed). Returns a list with one tuple of
+    reps, intensities and weights per exercise, in the order of
+    Program.iter_exercises().
+    """
+    header, position = _read_header(data)
+    return _read_week(data, header, position, week)
+
+
+def loads(data, rendered=True, lazy=False):
+    """
+    Decode bytes from dumps into a Program.
+    If ´rendered´ is False, only the header is decoded and the
+    program is returned as if it was never rendered. If ´lazy´ is True,
+    each week is decoded when it is first accessed, see LazyRenderedWeeks.
+    """
+    header, position = _read_header(data)
+
+    program = Program.__new__(Program)
+    for attribute in ['name', 'units', 'round', 'duration', 'nonlinearity', 'k',
+                      'intensity_list', 'intensity_model', 'reps_list', 'reps_model',
+                      'reps_per_exercise', 'reps_RM_model', 'reps_RM', 'mode', 'seed']:
+        setattr(program, attribute, header[attribute])
+    program.k_list = [S(program.k, w, 100, 0, 1, program.duration)
+                      for w in range(1, program.duration+1)]
+
+    program.days = []
+    for day_header in header['days']:
+        day = Day()
+        # name, current_max, desired_max, low_reps, high_reps, reps and, since
+        # exercises have ids, the id
+        for settings in day_header['main']:
+            day.add_main(DynamicExercise(*settings))
+        for name, scheme in day_header['extra']:
+            day.add_extra(StaticExercise(name, scheme))
+        program.days.append(day)
+
+    weeks, = _UINT32.unpack_from(data, position)
+    if not (weeks and rendered):
+        program.rendered = False
+        return program
+
+    program._assign_ids()
+    ids = [ex.id for ex in program.iter_exercises()]
+    program.maxima = dict(zip(ids, header['maxima']))
+    if lazy:
+        program.rendered = LazyRenderedWeeks(ids, weeks, program.units,
+                                             functools.partial(_read_week, data, header, position))
+        return program
+
+    # Build the arrays of RenderedWeeks directly, without lists per exercise-week
+    arrays = [_read_arrays(data, header, position, week) for week in range(1, weeks+1)]
+    sets, reps, multiples = [np.concatenate(a) for a in zip(*arrays)]
+    reps = reps.astype(np.uint8)
+    table = np.array([0] + header['reps_RM'][1:], dtype=np.float64)
+    offsets = np.concatenate([[0], np.cumsum(sets, dtype=np.uint32)])
+    program.rendered = RenderedWeeks.from_arrays(ids, weeks, program.units, reps, table[reps],
+                                                 multiples * header['round'], offsets)
+    return program
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized (NumPy) counterparts of the rep scheme search in main.py.
+
+Instead of drawing one rep scheme at a time with create_reps and scoring it
+with get_MI and loss_measure, every candidate for every exercise-week is
+drawn at once into a zero padded array of shape (tasks, samples, sets),
+and all candidates are scored together.
+"""
+
+from __future__ import division
+import numpy as np
+
+
+def create_reps_batch(low, high, num, samples, rng):
+    """
+    Vectorized version of create_reps.
+
+    Parameters
+    ----------
+    low : Array of shape (tasks,), lowest number of reps.
+    high : Array of shape (tasks,), highest number of reps.
+    num : Array of shape (tasks,), total number of reps.
+    samples : Number of rep schemes to draw for each task.
+    rng : A numpy.random.Generator.
+
+    Returns
+    -------
+    Integer array of shape (tasks, samples, sets). Every scheme is sorted
+    in descending order and padded with zeros at the end.
+    """
+    # Reps and totals are small, so int16 keeps the arrays compact
+    low = np.asarray(low, dtype=np.int16)[:, None, None]
+    num = np.asarray(num, dtype=np.int16)[:, None, None]
+    # create_reps calls random.randint(low, high), which requires low <= high
+    high = np.maximum(np.asarray(high, dtype=np.int16)[:, None, None], low)
+
+    # Every draw is at least ´low´, so the sum exceeds ´num´ after this many draws
+    sets = int(np.max(np.maximum(num, 0) // low)) + 2
+
+    # Uniform integers in [low, high], scaling floats is faster than rng.integers
+    uniform = rng.random((len(low), samples, sets), dtype=np.float32)
+    draws = low + (uniform * (high - low + 1)).astype(np.int16)
+
+    taken = np.cumsum(draws, axis=2, dtype=np.int16)
+    remainder = num - (taken - draws)  # What is left before each draw
+    fits = (remainder >= low) & (remainder <= high)
+    over = taken > num
+
+    # Index of the last set, the first position where create_reps breaks
+    last = np.argmax(fits | over, axis=2)[:, :, None]
+    sets = int(last.max()) + 1
+    draws, remainder, fits = draws[:, :, :sets], remainder[:, :, :sets], fits[:, :, :sets]
+
+    positions = np.arange(sets)
+    final = np.take_along_axis(np.where(fits, remainder, draws), last, axis=2)
+    reps = np.where(positions < last, draws, np.where(positions == last, final, 0))
+
+    return -np.sort(-reps, axis=2)
+
+
+def score_batch(reps, reps_RM, desired_MI, low):
+    """
+    Vectorized version of the error function in render_dynamic_exericse,
+    i.e. deviation from MI + spread of the reps + distance from low reps.
+
+    Parameters
+    ----------
+    reps : Array of shape (tasks, samples, sets) from create_reps_batch.
+    reps_RM : The ´reps_RM´ list of a program, indexed by reps.
+    desired_MI : Array of shape (tasks,), the desired average intensity.
+    low : Array of shape (tasks,), lowest number of reps.
+
+    Returns
+    -------
+    Tuple (intensity, error), where intensity has the same shape as reps
+    and error has shape (tasks, samples).
+    """
+    table = np.array([0] + list(reps_RM[1:]), dtype=np.float64)
+    intensity = table[reps]
+    valid = reps > 0
+    count = valid.sum(axis=2)
+
+    # Deviation from MI, see get_MI
+    MI = (reps * intensity).sum(axis=2) / reps.sum(axis=2)
+    err_1 = np.abs(MI - np.asarray(desired_MI, dtype=np.float64)[:, None])
+
+    # Spread of the reps, see loss_measure
+    smallest = np.take_along_axis(reps, (count - 1)[:, :, None], axis=2)[:, :, 0]
+    worst = (reps[:, :, 0] - smallest) ** 2
+    diff = np.where(valid[:, :, 1:], (reps[:, :, :-1] - reps[:, :, 1:]) ** 2, 0)
+    loss = np.where(worst == 0, 1, diff.sum(axis=2) / np.maximum(worst, 1))
+    err_2 = 100 * loss
+
+    # Punishes staying away from low reps
+    err_3 = np.abs(np.asarray(low)[:, None] - smallest)
+
+    return intensity, err_1 + err_2 + err_3
+
+
+def best_reps_batch(low, high, num, desired_MI, reps_RM, samples, rng):
+    """
+    Draw ´samples´ rep schemes per task and keep the one with the lowest error.
+
+    Returns
+    -------
+    List with one tuple (reps, intensity, error) per task, using plain
+    Python lists and numbers.
+    """
+    reps = create_reps_batch(low, high, num, samples, rng)
+    intensity, error = score_batch(reps, reps_RM, desired_MI, low)
+
+    best = np.argmin(error, axis=1)
+    tasks = np.arange(len(best))
+    reps, intensity, error = reps[tasks, best], intensity[tasks, best], error[tasks, best]
+
+    result = []
+    for r, i, e in zip(reps.tolist(), intensity.tolist(), error.tolist()):
+        sets = len(r) - r.count(0)
+        result.append((r[:sets], i[:sets], e))
+    return result
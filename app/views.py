@@ -1,40 +1,89 @@
 # -*- coding: utf-8 -*-
-from app import app, models, db
-from app.streprogen import Day, StaticExercise, DynamicExercise, Program
-from flask import render_template, request, redirect, url_for, flash
-from app.functions import random_string
+from app import analytics, archive, models, db, read_db, metrics, render_cache, last_viewed, page_cache, render_queue, api_cache, batch_pool
+from app.api import ProgramDocument, Projection, ProjectionError
+from app.jobs import QueueFull
+from app.search import search as search_programs
+from app.streprogen import serialization, Day, StaticExercise, DynamicExercise, Program, render_programs
+from app.streprogen.batch import MAX_DAYS, MAX_EXERCISES
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, abort, Response, jsonify, make_response, \
+    stream_with_context
 from datetime import datetime
+import hashlib
+import itertools
+import json
+import os
 
-@app.route('/')
+blueprint = Blueprint('views', __name__)
+
+def find_program(unique_id):
+    """
+    Return the models.Program with the unique_id, or None. An archived
+    program is restored first, see app/archive.py.
+    """
+    program = read_db.query(models.Program).filter_by(unique_id=unique_id).first()
+    if program is None and archive.restore(unique_id):
+        program = models.Program.query.filter_by(unique_id=unique_id).first()
+    return program
+
+@blueprint.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/search', methods=['POST', 'GET'])
+@blueprint.route('/search', methods=['POST', 'GET'])
 def search():
     if request.method == 'POST':
         unique_id = request.form['unique_id'].strip()
-        if models.Program.query.filter_by(unique_id=unique_id).first() is None:
-            flash(u'The program you searched for was not found.','danger')
-        else:
-            return redirect(url_for('overview', unique_id=unique_id))
-    return render_template('search.html')
+        if find_program(unique_id) is not None:
+            return redirect(url_for('views.overview', unique_id=unique_id))
+        return redirect(url_for('views.search', q=unique_id))
+
+    query = request.args.get('q', '').strip()
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        page = 1
+    results, more = search_programs(query, page) if query else ([], False)
+    if query and not results and page == 1:
+        flash(u'The program you searched for was not found.','danger')
+    return render_template('search.html', query=query, results=results, page=page, more=more)
+
+@blueprint.route('/api/search')
+def search_api():
+    """
+    Ranked search by reference code prefix and name, for autocomplete,
+    e.g. /api/search?q=squ&page=1&per_page=10.
+    """
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 10))
+    except ValueError:
+        return jsonify(error='page and per_page must be integers.'), 400
+    results, more = search_programs(request.args.get('q', ''), page, per_page)
+    for result in results:
+        result['url'] = url_for('views.overview', unique_id=result['unique_id'], _external=True)
+
+    response = jsonify(results=results, page=page, more=more)
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
 
-@app.route('/create')
+@blueprint.route('/create')
 def create():
     return render_template('create.html')
 
-@app.route('/edit/<unique_id>')
+@blueprint.route('/edit/<unique_id>')
 def edit(unique_id):
-    program = models.Program.query.filter_by(unique_id=unique_id).first()
+    program = find_program(unique_id)
     if program is None:
-        return redirect(url_for('index'))
-    program = program.pickle
+        return redirect(url_for('views.index'))
+    program = program.load(rendered=False)
     days = len(program.days)
     main = len(program.days[0].main_exercises)
     extra = len(program.days[0].extra_exercises)
-    return render_template('edit.html', program=program, days=days, main=main, extra=extra)
+    return render_template('edit.html', program=program, days=days, main=main, extra=extra,
+                           unique_id=unique_id)
 
-@app.route('/newprogram', methods=['POST', 'GET'])
+@blueprint.route('/newprogram', methods=['POST', 'GET'])
 def newprogram():
     if request.method == 'POST':
         name = request.form['name']
@@ -83,24 +132,19 @@ def newprogram():
 
             prog.days.append(new_day)
 
-        prog.render()
-
-        model_program = models.Program()
-
-        try_string = random_string(5)
-        test = models.Program.query.filter_by(unique_id=try_string).first()
-        while test != None:
-            try_string = random_string(5)
-            test = models.Program.query.filter_by(unique_id=try_string).first()
-
-        model_program.unique_id = try_string
-        model_program.date_creation = datetime.utcnow()
-        model_program.date_lastviewed = datetime.utcnow()
-        model_program.pickle = prog
-        db.session.add(model_program)
-        db.session.commit()
+        try:
+            # Set by /edit, the rendered weeks of that program are reused where possible
+            previous = request.form.get('previous')
+            job_id = render_queue.submit(create_program, prog, previous)
+        except QueueFull:
+            flash(u'<strong>The server is busy.</strong><br> '
+                  u'Too many programs are being created right now. '
+                  u'Hit "back" in your browser and try again in a minute.', 'danger')
+            response = make_response(render_template('blank.html'), 503)
+            response.headers['Retry-After'] = '30'
+            return response
 
-        return redirect(url_for('overview', unique_id=model_program.unique_id))
+        return redirect(url_for('views.job', job_id=job_id))
 
 
 
@@ -111,11 +155,10 @@ def newprogram():
         main = int(request.args.getlist('main')[0])
         extra = int(request.args.getlist('extra')[0])
     except:
-        return redirect(url_for('index'))
-    #Filter bad values
-    for val in [days, main, extra]:
-        if val > 5:
-            return redirect(url_for('index'))
+        return redirect(url_for('views.index'))
+    #Filter bad values, the same limits as specs of /api/batch
+    if days > MAX_DAYS or main > MAX_EXERCISES or extra > MAX_EXERCISES:
+        return redirect(url_for('views.index'))
 
     if program_type == 'simple':
         simple = True
@@ -124,52 +167,328 @@ def newprogram():
         simple = False
         return render_template('newprogram.html', days=days, main=main, extra=extra, simple=simple)
 
-    return redirect(url_for('index'))
+    return redirect(url_for('views.index'))
 
 
-@app.route('/docs')
+def create_program(prog, previous=None):
+    """
+    Render and store a program, returning its unique_id. Runs in a render job.
+    If ´previous´ is the unique_id of the program it was edited from, only the
+    exercise-weeks that changed are rendered.
+    """
+    previous = models.Program.query.filter_by(unique_id=previous).first() if previous else None
+    if previous is not None:
+        try:
+            previous = previous.program
+        except Exception:
+            # Some old programs can not be unpickled
+            current_app.logger.exception('Loading the edited program failed.')
+            previous = None
+
+    with metrics.span('render'):
+        if previous is not None:
+            prog.render_incremental(previous)
+        else:
+            render_cache.render(prog)
+
+    model_program = models.Program()
+    model_program.date_creation = datetime.utcnow()
+    model_program.date_lastviewed = datetime.utcnow()
+    model_program.program = prog
+    models.add_with_unique_id(model_program)
+    analytics.record([prog])
+    return model_program.unique_id
+
+@blueprint.route('/jobs/<job_id>')
+def job(job_id):
+    job = read_db.query(models.RenderJob).get(job_id)
+    if job is None:
+        return redirect(url_for('views.index'))
+    if job.status == 'done':
+        return redirect(url_for('views.overview', unique_id=job.unique_id))
+    if job.status == 'failed' or render_queue.timed_out(job):
+        flash(u'<strong>An error occured.</strong><br> '
+              u'The program could not be created. '
+              u'Hit "back" in your browser and try again.', 'danger')
+        return render_template('blank.html')
+    return render_template('job.html', job=job)
+
+@blueprint.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = read_db.query(models.RenderJob).get(job_id)
+    if job is None:
+        return jsonify(error='No such job.'), 404
+    status = {'id': job.id, 'status': job.status, 'error': job.error}
+    if render_queue.timed_out(job):
+        status.update(status='failed', error='The job timed out.')
+    if job.status == 'done':
+        status['unique_id'] = job.unique_id
+        status['url'] = url_for('views.overview', unique_id=job.unique_id, _external=True)
+    return jsonify(status)
+
+@blueprint.route('/api/jobs')
+def job_queue():
+    return jsonify(render_queue.stats())
+
+@blueprint.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Create many programs from a JSON object {"programs": [spec, ...]},
+    see app.streprogen.batch for the spec. Returns one result per spec,
+    either {"unique_id": ..., "url": ...} or {"error": ...}.
+    """
+    data = request.get_json(silent=True)
+    specs = data.get('programs') if isinstance(data, dict) else None
+    if not isinstance(specs, list):
+        return jsonify(error='Expected a JSON object with a list of "programs".'), 400
+    max_programs = int(os.environ.get('BATCH_MAX_PROGRAMS', 100))
+    if len(specs) > max_programs:
+        return jsonify(error='At most {} programs per batch.'.format(max_programs)), 413
+
+    try:
+        with metrics.span('render'):
+            rendered = batch_pool.run(render_programs, specs)
+    except QueueFull:
+        response = jsonify(error='The server is busy, try again in a minute.')
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    created = []
+    for prog, error in rendered:
+        if prog is None:
+            continue
+        model_program = models.Program()
+        model_program.date_creation = datetime.utcnow()
+        model_program.date_lastviewed = datetime.utcnow()
+        model_program.program = prog
+        created.append(model_program)
+    models.add_all_with_unique_ids(created)
+    analytics.record([prog for prog, error in rendered if prog is not None])
+
+    results = []
+    created = iter(created)
+    for prog, error in rendered:
+        if prog is None:
+            results.append({'error': error})
+        else:
+            unique_id = next(created).unique_id
+            results.append({'unique_id': unique_id,
+                            'url': url_for('views.overview', unique_id=unique_id, _external=True)})
+    return jsonify(results=results)
+
+@blueprint.route('/metrics')
+def metrics_endpoint():
+    """
+    Request latencies, span timings and cache and queue gauges of this
+    process, in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@blueprint.route('/docs')
 def docs():
     return render_template('docs.html')
 
-@app.route('/examples')
+@blueprint.route('/examples')
 def examples():
     return render_template('examples.html')
 
-@app.route('/overview/<unique_id>')
+@blueprint.route('/overview/<unique_id>')
 def overview(unique_id):
-    program = models.Program.query.filter_by(unique_id=unique_id).first()
+    program = find_program(unique_id)
     if program is None:
-        return redirect(url_for('index'))
-    program.date_lastviewed = datetime.utcnow()
-    db.session.commit()
+        return redirect(url_for('views.index'))
+    last_viewed.touch(unique_id)
+
+    return page_cache.respond('overview', unique_id, program.date_creation,
+                              lambda: render_template('overview.html', program=program))
+
+@blueprint.route('/stats/<unique_id>.json')
+def stats(unique_id):
+    program = find_program(unique_id)
+    if program is None:
+        abort(404)
+    statistics = program.statistics
+    if statistics is None:
+        statistics = json.dumps(program.program._statistics(), separators=(',', ':'))
+
+    response = Response(statistics, mimetype='application/json')
+    # A rendered program never changes
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+@blueprint.route('/api/programs/<unique_id>')
+def program_api(unique_id):
+    """
+    Parts of a program as JSON, e.g. /api/programs/<unique_id>?fields=weeks&weeks=2-4&days=1,
+    see app/api.py for the query.
+    """
+    try:
+        projection = Projection(request.args)
+    except ProjectionError as error:
+        return jsonify(error=str(error)), 400
+
+    def load():
+        program = find_program(unique_id)
+        if program is None:
+            return None
+        data = program.data
+        if data is None:
+            # Stored as a pickle before the compact format
+            data = serialization.dumps(program.load())
+        statistics = program.statistics
+        if statistics is None:
+            statistics = json.dumps(program.program._statistics(), separators=(',', ':'))
+        with metrics.span('decode'):
+            return ProgramDocument(unique_id, data, statistics)
+
+    document = api_cache.get(unique_id, load)
+    if document is None:
+        return jsonify(error='No program with the reference code {}.'.format(unique_id)), 404
+    try:
+        body = document.render(projection)
+    except ProjectionError as error:
+        return jsonify(error=str(error)), 400
 
-    return render_template('overview.html', program=program)
+    response = Response(body, mimetype='application/json')
+    # A rendered program never changes, so the body is the same for the query
+    response.set_etag(hashlib.sha1(body.encode('utf-8')).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
 
-@app.route('/print/<unique_id>')
+@blueprint.route('/api/analytics')
+@blueprint.route('/api/analytics/<metric>')
+def analytics_api(metric=None):
+    """
+    Aggregates across all programs, see app/analytics.py. Without a metric,
+    the number of programs and the metrics; with one, its largest counters,
+    e.g. /api/analytics/exercise?limit=10 for the top exercise names.
+    """
+    if metric is None:
+        programs = analytics.aggregate('programs', session=read_db)
+        result = {'programs': programs[0][1] if programs else 0,
+                  'metrics': dict((name, url_for('views.analytics_api', metric=name, _external=True))
+                                  for name in analytics.METRICS)}
+    elif metric in analytics.METRICS:
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            return jsonify(error='limit must be an integer.'), 400
+        counts = analytics.aggregate(metric, limit, session=read_db)
+        result = {'metric': metric, 'description': analytics.METRICS[metric],
+                  'counts': [{'key': key, 'count': count} for key, count in counts]}
+    else:
+        return jsonify(error='Unknown metric {}. Use {}.'.format(metric, ', '.join(analytics.METRICS))), 404
+
+    response = jsonify(result)
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+EXPORT_FORMATS = {'tex': ('iter_latex', 'application/x-tex'),
+                  'csv': ('iter_csv', 'text/csv'),
+                  'json': ('iter_json', 'application/json')}
+
+def export_response(chunks, filename, mimetype):
+    """
+    Stream the chunks of an export as a downloadable file. The first chunk
+    is produced before the response starts, so that an error there is a
+    500 and not a truncated file.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, '')
+    response = Response(stream_with_context(itertools.chain([first], chunks)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+    return response
+
+@blueprint.route('/export/<unique_id>.<format>')
+def export(unique_id, format):
+    if format not in EXPORT_FORMATS:
+        abort(404)
+    program = find_program(unique_id)
+    if program is None:
+        abort(404)
+
+    method, mimetype = EXPORT_FORMATS[format]
+    # Weeks are decoded as they are streamed, so the first chunk is sent right away
+    chunks = getattr(program.load(lazy=True), method)()
+    return export_response(chunks, '{}.{}'.format(unique_id, format), mimetype)
+
+@blueprint.route('/export/bulk.<format>')
+def export_bulk(format):
+    """
+    Export several programs, given as ?ids=ABCDE,FGHIJ, in one CSV or JSON
+    document. Programs are loaded and streamed one at a time.
+    """
+    if format not in ('csv', 'json'):
+        abort(404)
+    unique_ids = [i.strip() for i in request.args.get('ids', '').split(',') if i.strip()]
+    if not unique_ids or len(unique_ids) > 100:
+        abort(400)
+
+    def programs():
+        for unique_id in unique_ids:
+            program = find_program(unique_id)
+            if program is not None:
+                yield unique_id, program.load(lazy=True)
+
+    def csv_chunks():
+        yield 'program,week,day,exercise,set,reps,intensity,weight,units\n'
+        for unique_id, program in programs():
+            for chunk in program.iter_csv(header=False):
+                yield ''.join(unique_id + ',' + line for line in chunk.splitlines(True))
+
+    def json_chunks():
+        yield '{"programs": ['
+        for i, (unique_id, program) in enumerate(programs()):
+            yield '{}{{"unique_id": {}, "program": '.format(', ' if i else '', json.dumps(unique_id))
+            for chunk in program.iter_json():
+                yield chunk
+            yield '}'
+        yield ']}'
+
+    chunks = csv_chunks() if format == 'csv' else json_chunks()
+    return export_response(chunks, 'programs.{}'.format(format), EXPORT_FORMATS[format][1])
+
+@blueprint.route('/print/<unique_id>')
 def Print(unique_id):
-    program = models.Program.query.filter_by(unique_id=unique_id).first()
+    program = find_program(unique_id)
     if program is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('views.index'))
 
-    return render_template('print.html', program=program.pickle, unique_id=unique_id)
+    return page_cache.respond('print', unique_id, program.date_creation,
+                              lambda: render_template('print.html', program=program.program,
+                                                      unique_id=unique_id))
 
-@app.route('/rerender/<unique_id>')
+@blueprint.route('/rerender/<unique_id>')
 def rerender(unique_id):
     return ''
     program = models.Program.query.filter_by(unique_id=unique_id).first()
     if program is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('views.index'))
 
     from copy import deepcopy
-    program.pickle.render()
-    prog = deepcopy(program.pickle)
+    program.program.render()
+    prog = deepcopy(program.program)
     prog.name = 'Changed'
 
-    program.pickle = prog
+    program.program = prog
     db.session.commit()
-    return redirect(url_for('overview', unique_id=unique_id))
+    return redirect(url_for('views.overview', unique_id=unique_id))
 
-@app.route('/latest')
+@blueprint.route('/latest')
 def latest():
-    programs = models.Program.query.order_by('date_creation desc').limit(20).all()
-    return render_template('latest.html', programs=programs)
+    before = None
+    if 'date' in request.args and 'id' in request.args:
+        try:
+            before = (datetime.strptime(request.args['date'], '%Y-%m-%dT%H:%M:%S.%f'),
+                      int(request.args['id']))
+        except ValueError:
+            return redirect(url_for('views.latest'))
+
+    per_page = 20
+    programs = models.latest(limit=per_page, before=before, query=read_db.query(models.Program))
+    return render_template('latest.html', programs=programs, per_page=per_page,
+                           first_page=before is None)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind buffer for the date_lastviewed column.
+
+Viewing a program should be a pure read. Instead of one UPDATE and commit
+per page view, the last viewed timestamps are coalesced in memory and
+written in one batch by a background thread, every flush interval or
+when woken because the buffer grew large, and when the worker shuts down.
+Requests only record the timestamp, they never write.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime
+from flask import has_app_context
+from sqlalchemy import bindparam
+
+
+class LastViewedBuffer(object):
+    """
+    Coalesces last viewed timestamps per unique_id and flushes them in batches.
+    """
+    def __init__(self, db, table):
+        """
+        Parameters
+        ----------
+        db : The SQLAlchemy extension.
+        table : The program table, with unique_id and date_lastviewed columns.
+        """
+        self.app = None
+        self.db = db
+        self.table = table
+        self.interval = 60.0
+        self.max_size = 500
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        atexit.register(self.flush)
+
+    def init_app(self, app, interval=60, max_size=500):
+        """
+        Parameters
+        ----------
+        app : The Flask app, used for an app context when flushing.
+        interval : Seconds between flushes.
+        max_size : Flush when this many programs are buffered.
+        """
+        self.app = app
+        self.interval = float(interval)
+        self.max_size = int(max_size)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, unique_id, when=None):
+        """
+        Record that the program was viewed. Nothing is written until the
+        background thread flushes, after the interval or when the buffer is full.
+        """
+        when = when or datetime.utcnow()
+        with self._lock:
+            if self._pending.get(unique_id, when) <= when:
+                self._pending[unique_id] = when
+            full = len(self._pending) >= self.max_size
+            self._start_timer()
+        if full:
+            # Flushed by the background thread, the view never writes
+            self._wake.set()
+
+    def flush(self):
+        """
+        Write all buffered timestamps in one transaction. If it fails, the
+        timestamps are put back in the buffer and the error is raised.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, dict()
+        if not pending:
+            return
+
+        statement = (self.table.update()
+                     .where(self.table.c.unique_id == bindparam('_unique_id'))
+                     .values(date_lastviewed=bindparam('_date_lastviewed')))
+        rows = [{'_unique_id': unique_id, '_date_lastviewed': when}
+                for unique_id, when in pending.items()]
+        try:
+            if has_app_context():
+                # E.g. flushed by a command, a new app context would remove its sessions on teardown
+                self._write(statement, rows)
+            else:
+                with self.app.app_context():
+                    self._write(statement, rows)
+        except Exception:
+            with self._lock:
+                for unique_id, when in pending.items():
+                    if self._pending.get(unique_id, when) <= when:
+                        self._pending[unique_id] = when
+            raise
+
+    def _write(self, statement, rows):
+        with self.db.engine.begin() as connection:
+            connection.execute(statement, rows)
+
+    def _start_timer(self):
+        """
+        Start the background flushing thread, in the worker process that
+        first records a view (threads do not survive a fork).
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='last-viewed-flush')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Flushing last viewed timestamps failed.')
+                # The buffer stays full, wait instead of retrying on every view
+                time.sleep(self.interval)
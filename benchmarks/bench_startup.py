@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Startup time of the web app.
+
+Every run imports the package and calls create_app() in a fresh Python
+process, as a new worker does, and reads app.startup_seconds. The time
+to start the interpreter itself is not included.
+
+Usage (from the repository root):
+
+    python benchmarks/bench_startup.py                 # run and print
+    python benchmarks/bench_startup.py --budget 1.0    # fail if slower
+
+Exits with status 1 if the median startup time exceeds --budget seconds
+(default STARTUP_BUDGET_SECONDS, or 1.5).
+"""
+from __future__ import division, print_function
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+SCRIPT = """
+import warnings
+warnings.simplefilter('ignore')
+from app import create_app
+app = create_app({'TESTING': %s})
+print(app.startup_seconds)
+"""
+
+
+def startup_time(testing=False):
+    """
+    Return the startup time in seconds of a fresh process.
+    """
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT % testing], cwd=ROOT)
+    return float(output.decode('utf-8').split()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7, help='number of processes to start (default 7)')
+    parser.add_argument('--budget', type=float,
+                        default=float(os.environ.get('STARTUP_BUDGET_SECONDS', 1.5)),
+                        help='allowed median startup time in seconds')
+    parser.add_argument('--testing', action='store_true',
+                        help='create the app with TESTING set, without the debug toolbar')
+    args = parser.parse_args(argv)
+
+    times = sorted(startup_time(args.testing) for i in range(args.runs))
+    median = times[len(times) // 2]
+    print('startup   min {:8.3f} ms   median {:8.3f} ms   max {:8.3f} ms'.format(
+        times[0] * 1000, median * 1000, times[-1] * 1000))
+    if median > args.budget:
+        print('Over the budget of {:.3f} ms.'.format(args.budget * 1000))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
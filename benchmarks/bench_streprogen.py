@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the streprogen engine.
+
+Times the building blocks (create_reps, list_of_random, loss_measure, S,
+building a PartitionIndex, rendering a single exercise-week) and full Program.render() / to_latex()
+over a sweep of weeks, days, exercises and rep ranges, with fixed seeds.
+For rendering, the mean error of the chosen rep schemes is recorded
+alongside the time, so speedups that hurt the programs are visible.
+
+Usage (from the repository root):
+
+    python benchmarks/bench_streprogen.py            # run and print
+    python benchmarks/bench_streprogen.py --save     # write baseline.json
+    python benchmarks/bench_streprogen.py --check    # compare with baseline.json
+
+--check exits with status 1 if any benchmark is slower than the baseline
+by more than --tolerance, or has a higher error by more than --error-tolerance.
+Timings depend on the machine, so save a baseline on the machine you check on.
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+# Import the engine as a top-level package, without creating the Flask app
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'app'))
+from streprogen.main import (Day, DynamicExercise, Program, S, create_reps,
+                             list_of_random, loss_measure, rep_scheme_error)
+from streprogen.partitions import PartitionIndex
+
+
+def make_program(weeks, days, exercises, reps, seed=0):
+    """
+    Return an unrendered program. The exercises get low reps between 1 and 5
+    and high reps ´reps´, drawn with a fixed seed.
+    """
+    rng = random.Random(seed)
+    program = Program('bench', units='kg', round_to=2.5, weeks=weeks, nonlinearity=10,
+                      intensity_list=[rng.randint(68, 78) for i in range(weeks)],
+                      reps_list=[rng.choice([85, 100, 115]) for i in range(weeks)],
+                      reps_per_exercise=25, reps_RM='tight')
+    for d in range(days):
+        day = Day()
+        for e in range(exercises):
+            day.add_main(DynamicExercise('Exercise {}-{}'.format(d, e), 100, 120,
+                                         rng.randint(1, 5), reps))
+        program.add_day(day)
+    return program
+
+
+def program_error(program):
+    """
+    Mean error of the rep schemes in a rendered program.
+    """
+    errors = []
+    for mainex, week in program._render_tasks():
+        reps, intensity, weights = program.rendered[week][mainex.id][1]
+        errors.append(rep_scheme_error(reps, intensity, program.intensity_list[week-1],
+                                       program.maxima[mainex.id][week-1]))
+    return sum(errors) / len(errors)
+
+
+def measure(function, repeat=5):
+    """
+    Return the best time per call in seconds.
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    return min([elapsed] + timer.repeat(repeat - 1, number)) / number
+
+
+def micro_benchmarks():
+    results = {}
+    for low, high, num in [(1, 8, 25), (3, 8, 25), (3, 6, 40)]:
+        random.seed(0)
+        results['create_reps/{}-{}-{}'.format(low, high, num)] = {
+            'time': measure(lambda: create_reps(low, high, num))}
+
+    for low, high, num in [(1, 8, 30), (3, 8, 30)]:
+        results['PartitionIndex/{}-{}-{}'.format(low, high, num)] = {
+            'time': measure(lambda: PartitionIndex(low, high, num), repeat=3)}
+
+    random.seed(0)
+    results['list_of_random/1-5-52'] = {'time': measure(lambda: list_of_random(1, 5, 52))}
+    results['loss_measure/5'] = {'time': measure(lambda: loss_measure([8, 7, 6, 5, 4]))}
+    results['S'] = {'time': measure(lambda: S(1.0, 4, 120, 100, 1, 12))}
+
+    program = make_program(weeks=12, days=3, exercises=3, reps=8)
+    program.render(seed=0)
+    exercise = program.days[0].main_exercises[0]
+    random.seed(0)
+    results['render_dynamic_exericse'] = {
+        'time': measure(lambda: Program.render_dynamic_exericse(exercise, program, 6))}
+    tasks = program._render_tasks()
+    results['render_dynamic_exercises/{}'.format(len(tasks))] = {
+        'time': measure(lambda: Program.render_dynamic_exercises(tasks, program))}
+    return results
+
+
+def macro_benchmarks(quick=False):
+    results = {}
+    if quick:
+        sweep = [(8, 3, 3, 8), (26, 5, 5, 8)]
+    else:
+        sweep = [(weeks, days, exercises, reps)
+                 for weeks in [4, 12, 26, 52]
+                 for days, exercises in [(1, 1), (3, 3), (5, 5)]
+                 for reps in [6, 8]]
+
+    for weeks, days, exercises, reps in sweep:
+        for engine in ['index', 'numpy', 'python']:
+            name = 'render/{}/w{}-d{}-e{}-r{}'.format(engine, weeks, days, exercises, reps)
+            program = make_program(weeks, days, exercises, reps)
+            time = measure(lambda: program.render(engine=engine, seed=0), repeat=3)
+            # The mean error over a few seeds, the time is for one render
+            errors = []
+            for seed in range(5):
+                program.render(engine=engine, seed=seed)
+                errors.append(program_error(program))
+            results[name] = {'time': time, 'error': sum(errors) / len(errors)}
+
+        program = make_program(weeks, days, exercises, reps)
+        program.render(seed=0)
+        name = 'to_latex/w{}-d{}-e{}-r{}'.format(weeks, days, exercises, reps)
+        results[name] = {'time': measure(program.to_latex, repeat=3)}
+    return results
+
+
+def check(results, baseline, tolerance, error_tolerance):
+    """
+    Print the comparison with the baseline and return the names of regressions.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        new, old = results[name], baseline[name]
+        ratio = new['time'] / old['time']
+        line = '{:45s} {:8.3f}x'.format(name, ratio)
+        slower = ratio > 1 + tolerance
+        worse = 'error' in old and new['error'] > old['error'] * (1 + error_tolerance) + 1e-9
+        if 'error' in old:
+            line += '   error {:7.3f} -> {:7.3f}'.format(old['error'], new['error'])
+        if slower or worse:
+            line += '   REGRESSION'
+            regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', action='store_true', help='write the results to the baseline')
+    parser.add_argument('--check', action='store_true', help='compare the results with the baseline')
+    parser.add_argument('--quick', action='store_true', help='run a reduced sweep')
+    parser.add_argument('--baseline', default=BASELINE, help='path of the baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown (default 0.5)')
+    parser.add_argument('--error-tolerance', type=float, default=0.05,
+                        help='allowed relative increase of the error (default 0.05)')
+    args = parser.parse_args(argv)
+    warnings.simplefilter('ignore')
+
+    results = micro_benchmarks()
+    results.update(macro_benchmarks(quick=args.quick))
+
+    if args.check:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = check(results, baseline, args.tolerance, args.error_tolerance)
+        print('{} regression(s).'.format(len(regressions)))
+        return 1 if regressions else 0
+
+    for name in sorted(results):
+        line = '{:45s} {:10.3f} ms'.format(name, results[name]['time'] * 1000)
+        if 'error' in results[name]:
+            line += '   error {:7.3f}'.format(results[name]['error'])
+        print(line)
+
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
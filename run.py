@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-from app import app
+from app import create_app, models
+
+app = create_app()
 
 if __name__ == '__main__':
-    app.run() #port = int(os.environ.get('PORT', 5000)
\ No newline at end of file
+    # The local database is created or upgraded here, on Heroku by ´flask init-db´
+    with app.app_context():
+        models.create_schema()
+    app.run() #port = int(os.environ.get('PORT', 5000)
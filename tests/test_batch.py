@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Program specs of /api/batch, see app.streprogen.batch.
+"""
+import copy
+import pytest
+from app.streprogen.batch import program_from_spec, render_programs, MAX_DURATION, MAX_DAYS, MAX_EXERCISES
+
+SQUAT = {'name': 'Squat', 'current_max': 100, 'desired_max': 110, 'low_reps': 3, 'high_reps': 8}
+SPEC = {'name': 'Batch', 'weeks': 4, 'intensity_list': [70, 72, 74, 76], 'reps_list': [100, 90, 110, 100],
+        'days': [{'main': [SQUAT], 'extra': [{'name': 'Abs', 'scheme': '3x10'}]}]}
+
+
+def spec(**changes):
+    spec = copy.deepcopy(SPEC)
+    spec.update(changes)
+    return spec
+
+
+def test_largest_spec_is_valid():
+    day = {'main': [SQUAT] * MAX_EXERCISES, 'extra': [{'name': 'Abs', 'scheme': '3x10'}] * MAX_EXERCISES}
+    program = program_from_spec(spec(weeks=MAX_DURATION, intensity_list=[70] * MAX_DURATION,
+                                      reps_list=[100] * MAX_DURATION, days=[day] * MAX_DAYS))
+    assert (program.duration, len(program.days)) == (MAX_DURATION, MAX_DAYS)
+
+
+@pytest.mark.parametrize('changes, message', [
+    ({'weeks': MAX_DURATION + 1}, 'weeks must be within'),
+    ({'weeks': 10**9}, 'weeks must be within'),
+    ({'weeks': 'many'}, 'weeks must be an integer'),
+    ({'days': [{'main': [SQUAT]}] * (MAX_DAYS + 1)}, 'at most {} days'.format(MAX_DAYS)),
+    ({'days': [{'main': [SQUAT] * (MAX_EXERCISES + 1)}]}, 'more than {} main'.format(MAX_EXERCISES)),
+    ({'days': [{'main': [SQUAT], 'extra': [{'name': 'Abs', 'scheme': '3x10'}] * (MAX_EXERCISES + 1)}]},
+     'more than {} extra'.format(MAX_EXERCISES)),
+])
+def test_oversized_spec_is_rejected(changes, message):
+    with pytest.raises(ValueError, match=message):
+        program_from_spec(spec(**changes))
+
+
+def test_oversized_spec_gets_its_own_error():
+    results = render_programs([SPEC, spec(weeks=MAX_DURATION + 1), SPEC], processes=1)
+    assert [program is not None for program, error in results] == [True, False, True]
+    assert 'weeks must be within' in results[1][1]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+The numpy engine against the python engine, see Program.render.
+
+The engines draw their candidate rep schemes from different random number
+generators, so only the schemes with a single candidate are identical. The
+rest are compared by rep_scheme_error, which the numpy engine computes with
+score_batch.
+"""
+import random
+import numpy as np
+import pytest
+from app.streprogen.batch import program_from_spec
+from app.streprogen.main import rep_scheme_error
+from app.streprogen.vectorized import best_reps_batch
+
+
+def exercise(name, current_max, desired_max, low_reps, high_reps, **settings):
+    return dict(name=name, current_max=current_max, desired_max=desired_max,
+                low_reps=low_reps, high_reps=high_reps, **settings)
+
+
+SPEC = {'name': 'Engines', 'weeks': 8, 'intensity_list': [70, 72, 74, 76, 78, 80, 82, 75],
+        'reps_list': [100, 90, 110, 100, 95, 85, 105, 80],
+        'days': [{'main': [exercise('Squat', 100, 120, 3, 8), exercise('Bench press', 80, 90, 5, 10)]},
+                 # 6 to 8 reps per week, always done in one set
+                 {'main': [exercise('Deadlift', 140, 160, 1, 6), exercise('Press', 50, 55, 4, 10, reps=8)]}]}
+
+
+def rendered(engine, seed):
+    program = program_from_spec(SPEC)
+    program.render(engine=engine, seed=seed)
+    return program
+
+
+def errors(program):
+    return dict(((ex.id, week), rep_scheme_error(reps, intensity, program.intensity_list[week-1],
+                                                 program.maxima[ex.id][week-1]))
+                for ex in program.iter_exercises() for week in range(1, program.duration + 1)
+                for reps, intensity, weights in [program.rendered[week][ex.id][1]])
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_engines_agree(seed):
+    numpy, python = rendered('numpy', seed), rendered('python', seed)
+    assert numpy.maxima == python.maxima
+    for week in range(1, numpy.duration + 1):
+        assert numpy.rendered[week]['press'][1] == python.rendered[week]['press'][1]
+
+    numpy_errors, python_errors = errors(numpy), errors(python)
+    assert all(numpy_errors[key] == python_errors[key] for key in numpy_errors if key[0] == 'press')
+    # The best of 25 random schemes, the average error differs by a few percent
+    numpy_mean = sum(numpy_errors.values()) / len(numpy_errors)
+    python_mean = sum(python_errors.values()) / len(python_errors)
+    assert abs(numpy_mean - python_mean) <= 0.1 * python_mean
+
+
+def test_batch_error_is_rep_scheme_error():
+    reps_RM = program_from_spec(SPEC).reps_RM
+    rng = random.Random(0)
+    low = [rng.randint(1, 5) for i in range(50)]
+    high = [rng.randint(l + 1, 10) for l in low]
+    num = [rng.randint(10, 40) for i in range(50)]
+    desired_MI = [rng.randint(65, 85) for i in range(50)]
+    best = best_reps_batch(low, high, num, desired_MI, reps_RM, 25, np.random.default_rng(0))
+    for (reps, intensity, error), l, MI in zip(best, low, desired_MI):
+        assert intensity == [reps_RM[rep] for rep in reps]
+        assert error == pytest.approx(rep_scheme_error(reps, intensity, MI, l))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Exports of programs, see Program.iter_latex, iter_csv and iter_json.
+"""
+import json
+import pytest
+from app import create_app
+from app.streprogen import Day, StaticExercise
+from app.streprogen.batch import program_from_spec
+
+SPEC = {'name': 'Extras', 'weeks': 3, 'intensity_list': [70, 72, 74], 'reps_list': [100, 90, 110],
+        'days': [{'main': [{'name': 'Squat', 'current_max': 100, 'desired_max': 110,
+                            'low_reps': 3, 'high_reps': 8}]}]}
+
+
+def rendered_program():
+    program = program_from_spec(SPEC)
+    # A day with only static exercises, which specs do not allow
+    day = Day()
+    day.add_extra(StaticExercise('Abs', '3x10'))
+    program.add_day(day)
+    program.render(seed=1)
+    return program
+
+
+def test_latex_with_an_extras_only_day():
+    program = rendered_program()
+    latex = program.to_latex()
+    assert latex.count('\\subsection*{Day 2}') == program.duration
+    assert latex.count('\\begin{tabular}') == 1 + program.duration
+    assert latex.rstrip().endswith('\\end{document}')
+
+
+def test_csv_and_json_with_an_extras_only_day():
+    program = rendered_program()
+    csv = ''.join(program.iter_csv())
+    assert 'Abs' in csv
+    document = json.loads(''.join(program.iter_json()))
+    assert [len(day) for day in document['weeks'][0]['days']] == [1, 0]
+
+
+def test_export_errors_before_the_response_starts():
+    from app.views import export_response
+
+    def chunks():
+        raise ValueError('Broken program')
+        yield ''
+
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.test_request_context():
+        with pytest.raises(ValueError):
+            export_response(chunks(), 'broken.tex', 'application/x-tex')
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Render jobs, see app.jobs.RenderQueue.
+"""
+from datetime import datetime, timedelta
+import pytest
+from app import create_app, db, render_queue
+from app.models import RenderJob
+
+
+@pytest.fixture
+def app():
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def submitted(job_id, age):
+    job = RenderJob(id=job_id, status='queued', date_submitted=datetime.utcnow() - timedelta(seconds=age))
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_expired_job_stays_failed(app):
+    submitted('old', render_queue.timeout + 60)
+    assert render_queue.expire() == (1, 0)
+    rendered = []
+    render_queue._run('old', lambda: rendered.append(1) or 'ABCDE', ())
+    db.session.expire_all()
+    job = RenderJob.query.filter_by(id='old').one()
+    assert (job.status, job.unique_id, rendered) == ('failed', None, [])
+
+
+def test_pending_job_is_done(app):
+    submitted('new', 0)
+    assert render_queue.expire() == (0, 0)
+    render_queue._run('new', lambda: 'ABCDE', ())
+    db.session.expire_all()
+    job = RenderJob.query.filter_by(id='new').one()
+    assert (job.status, job.unique_id) == ('done', 'ABCDE')
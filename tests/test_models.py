@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Storing programs, see app.models.
+"""
+from datetime import datetime
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db, models
+from app.models import Program, ReservedId, RenderJob
+
+
+@pytest.fixture
+def app():
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def ids(monkeypatch, *unique_ids):
+    unique_ids = iter(unique_ids)
+    monkeypatch.setattr(models, 'random_string', lambda length: next(unique_ids))
+
+
+def test_colliding_unique_id_is_retried(app, monkeypatch):
+    db.session.add(ReservedId(unique_id='AAAAA'))
+    db.session.commit()
+    ids(monkeypatch, 'AAAAA', 'BBBBB')
+    program = models.add_with_unique_id(Program(date_creation=datetime.utcnow()))
+    assert program.unique_id == 'BBBBB'
+    assert Program.query.filter_by(unique_id='BBBBB').count() == 1
+
+
+def test_other_integrity_error_is_raised(app, monkeypatch):
+    db.session.add(RenderJob(id='job', status='done'))
+    db.session.commit()
+    # Commits along with the program, and fails on the primary key of render_job
+    db.session.add(RenderJob(id='job', status='done'))
+    ids(monkeypatch, 'AAAAA')
+    with pytest.raises(IntegrityError, match='render_job.id'):
+        models.add_with_unique_id(Program(date_creation=datetime.utcnow()))
+    assert Program.query.count() == 0
+
+
+@pytest.mark.parametrize('message, collision', [
+    ('UNIQUE constraint failed: reserved_id.unique_id', True),
+    ('UNIQUE constraint failed: program.unique_id', True),
+    ('UNIQUE constraint failed: archived_program.unique_id', False),
+    ('NOT NULL constraint failed: program.unique_id', False),
+    ('duplicate key value violates unique constraint "reserved_id_pkey"', True),
+    ('duplicate key value violates unique constraint "ix_program_unique_id"', True),
+    ('duplicate key value violates unique constraint "render_job_pkey"', False),
+])
+def test_id_collision(message, collision):
+    assert bool(models.ID_COLLISION.search(message)) == collision
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+The index of rep schemes against brute force, see app/streprogen/partitions.py.
+"""
+import itertools
+import random
+import pytest
+from app.streprogen import main
+from app.streprogen.batch import program_from_spec
+from app.streprogen.partitions import (MAX_PARTITIONS, count_partitions, count_schemes,
+                                       iter_partitions, iter_schemes, partition_index)
+
+KEYS = [(low, high, total) for low in range(1, 5) for high in range(low, 9) for total in range(1, 21)]
+
+
+def brute_force_partitions(total, low, high):
+    """
+    Every descending tuple of integers in [low, high] summing to total.
+    """
+    found = set()
+    for sets in range(1, total // low + 1):
+        for scheme in itertools.combinations_with_replacement(range(high, low - 1, -1), sets):
+            if sum(scheme) == total:
+                found.add(scheme)
+    return found
+
+
+def create_reps_outcomes(low, high, total):
+    """
+    Every list create_reps can return, following every draw of randint.
+    """
+    found = set()
+
+    def draw(taken, reps):
+        if low <= total - taken <= high:
+            found.add(tuple(sorted(reps + [total - taken], reverse=True)))
+            return
+        for new in range(low, high + 1):
+            if taken + new > total:
+                found.add(tuple(sorted(reps + [new], reverse=True)))
+            else:
+                draw(taken + new, reps + [new])
+
+    draw(0, [])
+    return found
+
+
+@pytest.mark.parametrize('low, high, total', KEYS)
+def test_partitions(low, high, total):
+    partitions = list(iter_partitions(total, low, high))
+    assert set(partitions) == brute_force_partitions(total, low, high)
+    assert len(partitions) == len(set(partitions)) == count_partitions(total, low, high)
+
+
+@pytest.mark.parametrize('low, high, total', KEYS)
+def test_schemes_cover_create_reps(low, high, total):
+    schemes = list(iter_schemes(total, low, high))
+    assert len(schemes) == len(set(schemes))
+    assert len(schemes) <= count_schemes(total, low, high)
+    # Every list create_reps can return is indexed
+    assert create_reps_outcomes(low, high, total) <= set(schemes)
+    for scheme in schemes:
+        assert list(scheme) == sorted(scheme, reverse=True)
+        assert all(low <= reps <= high for reps in scheme)
+        # Exact, or overshooting by less than a set
+        assert 0 <= sum(scheme) - total < high
+
+
+def test_index_matches_schemes():
+    index = partition_index(3, 8, 20)
+    schemes = set(iter_schemes(20, 3, 8))
+    assert len(index) == len(schemes)
+    assert set(tuple(reps[:sets]) for reps, sets in zip(index.reps.tolist(), index.sets)) == schemes
+
+    reps_RM = [None, 97.5, 93.1, 88.8, 84.4, 80.0, 75.6, 71.3, 66.9, 62.5, 58.1]
+    reps, intensity, error = index.choose(reps_RM, 75)
+    assert tuple(reps) in schemes
+    assert intensity == [reps_RM[r] for r in reps]
+
+
+def test_large_keys_fall_back_to_sampling(monkeypatch):
+    low, high, total = 1, 10, 60
+    assert count_schemes(total, low, high) > MAX_PARTITIONS
+    assert partition_index(low, high, total) is None
+    assert partition_index(5, 4, 10) is None
+
+    spec = {'name': 'Fallback', 'weeks': 3, 'reps_per_exercise': total,
+            'intensity_list': [70, 75, 80], 'reps_list': [100, 100, 100],
+            'days': [{'main': [{'name': 'Deadlift', 'current_max': 100, 'desired_max': 110,
+                                'low_reps': low, 'high_reps': high}]}]}
+    calls = []
+
+    def create_reps(*args):
+        calls.append(args)
+        return sampled(*args)
+
+    sampled = main.create_reps
+    monkeypatch.setattr(main, 'create_reps', create_reps)
+    program = program_from_spec(spec)
+    program.render(engine='index', seed=3)
+    assert calls
+    for week, days in program.iter_weeks():
+        reps, intensity, weights = days[0][0]
+        assert reps == sorted(reps, reverse=True)
+        assert all(1 <= r <= high for r in reps)
+        assert sum(reps) >= total
+
+
+def test_create_reps_outcomes_are_exhaustive():
+    # The brute force itself, against sampling create_reps
+    rng = random.Random(0)
+    outcomes = create_reps_outcomes(2, 5, 12)
+    for i in range(2000):
+        assert tuple(main.create_reps(2, 5, 12, rng)) in outcomes
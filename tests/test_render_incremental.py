@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Re-rendering of edited programs, see Program.render_incremental.
+"""
+import copy
+from app.streprogen import serialization
+from app.streprogen.batch import program_from_spec
+
+SPEC = {'name': 'Edited', 'weeks': 4, 'intensity_list': [70, 72, 74, 76],
+        'reps_list': [100, 90, 110, 100],
+        'days': [{'main': [{'name': 'Squat', 'current_max': 100, 'desired_max': 120,
+                            'low_reps': 3, 'high_reps': 8},
+                           {'name': 'Squat', 'current_max': 80, 'desired_max': 90,
+                            'low_reps': 4, 'high_reps': 8}]},
+                 {'main': [{'name': 'Bench press', 'current_max': 60, 'desired_max': 70,
+                            'low_reps': 2, 'high_reps': 6}]}]}
+
+
+def rendered(spec, seed=1):
+    program = program_from_spec(spec)
+    program.render(seed=seed)
+    # As stored and loaded by the app
+    return serialization.loads(serialization.dumps(program))
+
+
+def schemes(program):
+    return dict(((ex.id, week), program.rendered[week][ex.id][1])
+                for ex in program.iter_exercises() for week in range(1, program.duration + 1))
+
+
+def edit(**changes):
+    spec = copy.deepcopy(SPEC)
+    for (day, exercise, setting), value in changes.get('exercises', {}).items():
+        spec['days'][day]['main'][exercise][setting] = value
+    spec.update(changes.get('program', {}))
+    return program_from_spec(spec)
+
+
+def test_unchanged_program_is_reused():
+    previous = rendered(SPEC)
+    program = edit()
+    assert program.render_incremental(previous, seed=2) == 0
+    assert schemes(program) == schemes(previous)
+    assert program.maxima == previous.maxima
+
+
+def test_edited_exercise_is_rendered():
+    previous = rendered(SPEC)
+    program = edit(exercises={(0, 1, 'desired_max'): 100})
+    assert program.render_incremental(previous, seed=2) == program.duration
+
+    before, after = schemes(previous), schemes(program)
+    for (exercise_id, week), scheme in after.items():
+        if exercise_id != 'squat-2':
+            assert scheme == before[exercise_id, week]
+    # Weights follow the new desired max
+    assert after['squat-2', 4] != before['squat-2', 4]
+
+
+def test_edited_week_is_rendered():
+    previous = rendered(SPEC)
+    program = edit(program={'intensity_list': [70, 80, 74, 76]})
+    exercises = len(list(program.iter_exercises()))
+    assert program.render_incremental(previous, seed=2) == exercises
+
+    before, after = schemes(previous), schemes(program)
+    for (exercise_id, week), scheme in after.items():
+        if week != 2:
+            assert scheme == before[exercise_id, week]
+
+
+def test_renamed_exercise_is_rendered():
+    previous = rendered(SPEC)
+    program = edit(exercises={(1, 0, 'name'): 'Incline bench press'})
+    assert program.render_incremental(previous, seed=2) == program.duration
+    before, after = schemes(previous), schemes(program)
+    for exercise_id in ('squat', 'squat-2'):
+        for week in range(1, program.duration + 1):
+            assert after[exercise_id, week] == before[exercise_id, week]
+
+
+def test_shared_setting_renders_everything():
+    previous = rendered(SPEC)
+    program = edit(program={'round_to': 5})
+    tasks = program.duration * len(list(program.iter_exercises()))
+    assert program.render_incremental(previous, seed=2) == tasks
+    assert all(weight % 5 == 0 for scheme in schemes(program).values() for weight in scheme[2])
+
+
+def test_statistics_are_updated():
+    previous = rendered(SPEC)
+    program = edit(exercises={(0, 0, 'desired_max'): 140})
+    program.render_incremental(previous, seed=2)
+    full = edit(exercises={(0, 0, 'desired_max'): 140})
+    full.rendered = program.rendered
+    assert program.statistics == full._statistics()
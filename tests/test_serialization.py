@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Round trips of the compact storage format, see app/streprogen/serialization.py.
+"""
+import pytest
+from app.streprogen import serialization
+from app.streprogen.batch import program_from_spec
+
+
+def make_program(round_to=2.5, weeks=4):
+    spec = {'name': 'Round trip', 'units': 'kg', 'round_to': round_to, 'weeks': weeks,
+            'intensity_list': [70 + w for w in range(weeks)],
+            'reps_list': [100 - 5 * w for w in range(weeks)],
+            'days': [{'main': [{'name': 'Squat', 'current_max': 100.3, 'desired_max': 121.7,
+                                'low_reps': 3, 'high_reps': 8},
+                               {'name': 'Squat', 'current_max': 80, 'desired_max': 90,
+                                'low_reps': 5, 'high_reps': 10}],
+                      'extra': [{'name': 'Abs', 'scheme': '3x10'}]},
+                     {'main': [{'name': 'Bench press', 'current_max': 60, 'desired_max': 70,
+                                'low_reps': 2, 'high_reps': 6}]}]}
+    program = program_from_spec(spec)
+    program.render(seed=1)
+    return program
+
+
+def weeks(program):
+    return list(program.iter_weeks())
+
+
+@pytest.mark.parametrize('round_to', [2.5, 1.25, 1, 0.5])
+def test_round_trip(round_to):
+    program = make_program(round_to)
+    decoded = serialization.loads(serialization.dumps(program))
+
+    assert weeks(decoded) == weeks(program)
+    assert ''.join(decoded.iter_json()) == ''.join(program.iter_json())
+    assert decoded.maxima == program.maxima
+    assert decoded.seed == program.seed
+    for week, days in weeks(decoded):
+        for day in days:
+            for reps, intensity, weights in day:
+                assert all(weight % round_to == 0 for weight in weights)
+
+
+def test_dumps_is_stable():
+    program = make_program()
+    data = serialization.dumps(program)
+    assert serialization.dumps(serialization.loads(data)) == data
+
+
+def test_lazy_decoding():
+    program = make_program(1.25)
+    data = serialization.dumps(program)
+    lazy = serialization.loads(data, lazy=True)
+
+    # Weeks out of order, each decoded on its own
+    for week in (3, 1, 4, 2):
+        for ex in program.iter_exercises():
+            assert lazy.rendered[week][ex.id][1] == program.rendered[week][ex.id][1]
+    assert weeks(lazy) == weeks(program)
+
+
+def test_single_week_and_header():
+    program = make_program(1.25)
+    data = serialization.dumps(program)
+
+    header = serialization.loads_header(data)
+    assert header['name'] == program.name
+    assert header['round'] == 1.25
+    assert header['duration'] == program.duration
+
+    for week, days in weeks(program):
+        schemes = [scheme for day in days for scheme in day]
+        assert [tuple(s) for s in serialization.loads_week(data, week)] == \
+            [tuple(s) for s in schemes]
+
+
+def test_unrendered_decoding():
+    program = make_program()
+    decoded = serialization.loads(serialization.dumps(program), rendered=False)
+    assert not decoded.rendered
+    assert [ex.name for ex in decoded.iter_exercises()] == \
+        [ex.name for ex in program.iter_exercises()]
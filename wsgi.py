@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Entry point of the web workers and the ´flask´ command line (FLASK_APP=wsgi.py).
+"""
+from app import create_app
+
+app = create_app()